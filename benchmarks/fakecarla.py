@@ -0,0 +1,100 @@
+"""
+A lightweight replacement of Carla for benchmarks: a Jack client named `Carla`
+with one MIDI input and two audio outputs, which plays a cosine at the pitch
+of the last note-on, starting exactly at the frame of the note-on.
+
+Since the tone starts from phase 0 of a cosine, its first sample is never 0 and
+onsets can be located with sample precision in the recordings.
+"""
+import contextlib
+import multiprocessing
+import os
+import threading
+
+import jack
+import numpy as np
+
+from pycarla import JackServer
+
+
+def run(servername=None, ready=None, stop=None):
+    """
+    Runs the fake Carla until `stop` (a ``multiprocessing.Event``) is set;
+    `ready` is set once the ports are registered.
+    """
+    if servername is not None:
+        os.environ['JACK_DEFAULT_SERVER'] = servername
+    client = jack.Client('Carla', servername=servername)
+    midi_in = client.midi_inports.register('events-in')
+    outs = [
+        client.outports.register('audio-out1'),
+        client.outports.register('audio-out2')
+    ]
+    state = {'gain': 0.0, 'step': 0.0, 'phase': 0}
+    samplerate = client.samplerate
+
+    def tone(out, start, stop):
+        if state['gain'] > 0 and stop > start:
+            t = np.arange(state['phase'], state['phase'] + stop - start)
+            out[start:stop] = state['gain'] * np.cos(state['step'] * t)
+            state['phase'] += stop - start
+
+    @client.set_process_callback
+    def process(frames):
+        out = outs[0].get_array()
+        out.fill(0)
+        start = 0
+        for offset, data in midi_in.incoming_midi_events():
+            tone(out, start, offset)
+            start = offset
+            status = bytes(data)[0] & 0xF0
+            if status == 0x90 and bytes(data)[2] > 0:
+                pitch = bytes(data)[1]
+                freq = 440 * 2**((pitch - 69) / 12)
+                state['gain'] = 0.5 * bytes(data)[2] / 127
+                state['step'] = 2 * np.pi * freq / samplerate
+                state['phase'] = 0
+            elif status in (0x80, 0x90):
+                state['gain'] = 0.0
+        tone(out, start, frames)
+        outs[1].get_array()[:] = out
+
+    with client:
+        if ready is not None:
+            ready.set()
+        if stop is None:
+            stop = threading.Event()
+        stop.wait()
+
+
+@contextlib.contextmanager
+def dummy_server(servername, samplerate, period, timeout=10):
+    """
+    Starts a Jack server named `servername` with the dummy driver and runs
+    the fake Carla on it in another process; the server and the fake Carla
+    are stopped on exit.
+
+    Raises `RuntimeError` if the fake Carla isn't ready within `timeout`
+    seconds.
+    """
+    server = JackServer(
+        ['-d', 'dummy', '-r',
+         str(samplerate), '-p',
+         str(period)], servername)
+    server.start()
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    synth = multiprocessing.Process(target=run,
+                                    args=(servername, ready, stop))
+    try:
+        synth.start()
+        if not ready.wait(timeout):
+            raise RuntimeError("The fake Carla didn't start")
+        yield servername
+    finally:
+        stop.set()
+        synth.join(timeout)
+        if synth.is_alive():
+            synth.terminate()
+            synth.join()
+        server.kill()
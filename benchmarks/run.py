@@ -0,0 +1,262 @@
+"""
+Benchmarks of the freewheel render path on a dummy Jack backend.
+
+For each period size, a Jack server with the dummy driver is started and a
+synthetic MIDI stream is rendered through `fakecarla`, measuring:
+
+* the realtime factor (seconds of audio rendered per second of wall time)
+* the wall time per Jack period
+* the duration of the process callbacks of `MIDIPlayer` and `AudioRecorder`
+  against the period budget (see ``JackClient.stats``)
+* the peak resident memory of the process running the `AudioRecorder`
+* the maximum error in frames between the onsets in the recording and the
+  frames at which the note-on messages were scheduled
+* the turnaround of many short renders with and without persistent clients
+  (``--jobs`` renders per case)
+* the push-to-output latency of ``MIDIPlayer.stream`` (in realtime, for
+  ``--stream-seconds`` seconds)
+* the startup time of ``Carla.start`` (only with ``--carla``)
+
+Each case runs in its own process, so that peak memory is not shared among
+cases. Results are written as JSON, to be compared across commits.
+
+Usage::
+
+    python -m benchmarks.run --periods 64 256 1024 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import time
+
+import mido
+import numpy as np
+
+from pycarla import AudioRecorder, Carla, MIDIPlayer
+from pycarla.schedule import EventSchedule
+
+from . import fakecarla
+
+
+def synthetic_messages(duration, interval=0.25, length=0.2):
+    """
+    One note every `interval` seconds, lasting `length` seconds, for
+    `duration` seconds
+    """
+    messages = []
+    for i in range(int(duration / interval)):
+        pitch = 48 + i % 36
+        messages.append(
+            mido.Message('note_on',
+                         note=pitch,
+                         velocity=100,
+                         time=interval - length if i > 0 else 0))
+        messages.append(mido.Message('note_off', note=pitch, time=length))
+    return messages
+
+
+def onsets(recorded):
+    """
+    Frames at which the first channel turns non-zero
+    """
+    sound = recorded[0] != 0
+    edges = np.flatnonzero(sound[1:] & ~sound[:-1]) + 1
+    if sound[0]:
+        edges = np.concatenate([[0], edges])
+    return edges
+
+
+def render_case(period, samplerate, duration, servername, queue):
+    with fakecarla.dummy_server(servername, samplerate, period):
+        schedule = EventSchedule.from_messages(synthetic_messages(duration))
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        with MIDIPlayer(servername, profile=True) as player,\
+                AudioRecorder(servername, profile=True) as recorder:
+            start = time.perf_counter()
+            recorder.start(duration, condition=player.is_ready)
+            player.synthesize_messages(schedule, condition=recorder.is_ready)
+            player.wait(in_fw=True, out_fw=True)
+            recorder.wait(in_fw=True, out_fw=False)
+            wall = time.perf_counter() - start
+            recorded = recorder.recorded
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+            expected = schedule.frames(samplerate)[::2]
+            found = onsets(recorded)
+            n = min(len(expected), len(found))
+            if n > 0:
+                onset_error = int(np.max(np.abs(found[:n] - expected[:n])))
+            else:
+                onset_error = None
+            frames = recorded.shape[1]
+            queue.put({
+                'period': period,
+                'samplerate': samplerate,
+                'audio_seconds': frames / samplerate,
+                'wall_seconds': wall,
+                'realtime_factor': frames / samplerate / wall,
+                'wall_per_period_us': wall / (frames / period) * 1e6,
+                'peak_rss_kb': rss_after,
+                'recorder_rss_kb': rss_after - rss_before,
+                'onsets_expected': int(len(expected)),
+                'onsets_found': int(len(found)),
+                'max_onset_error_frames': onset_error,
+                'xruns': max(player.render_xruns(), recorder.render_xruns()),
+                'player_callback': player.stats(),
+                'recorder_callback': recorder.stats()
+            })
+
+
+def turnaround_case(period, samplerate, jobs, servername, queue):
+    result = {'period': period, 'samplerate': samplerate, 'jobs': jobs}
+    with fakecarla.dummy_server(servername, samplerate, period):
+        schedule = EventSchedule.from_messages(synthetic_messages(0.25))
+        for persistent in [False, True]:
+            with MIDIPlayer(servername, persistent=persistent) as player,\
+                    AudioRecorder(servername,
+                                  persistent=persistent) as recorder:
+                recorder.set_freewheel(True)
+                start = time.perf_counter()
+                for i in range(jobs):
+                    recorder.start(schedule.duration,
+                                   condition=player.is_ready)
+                    player.synthesize_messages(schedule,
+                                               condition=recorder.is_ready)
+                    player.wait(in_fw=True, out_fw=True)
+                    recorder.wait(in_fw=True, out_fw=True)
+                wall = time.perf_counter() - start
+                recorder.set_freewheel(False)
+            key = 'persistent' if persistent else 'reconnecting'
+            result[key + '_job_ms'] = wall / jobs * 1e3
+        queue.put(result)
+
+
+def stream_case(period, samplerate, seconds, servername, queue):
+    with fakecarla.dummy_server(servername, samplerate, period):
+        with MIDIPlayer(servername) as player:
+            player.stream()
+            end = time.perf_counter() + seconds
+            i = 0
+            while time.perf_counter() < end:
+                pitch = 48 + i % 36
+                player.push(mido.Message('note_on', note=pitch, velocity=100))
+                time.sleep(0.01)
+                player.push(mido.Message('note_off', note=pitch))
+                time.sleep(0.04)
+                i += 1
+            player.end_stream()
+            player.wait(timeout=10)
+            result = player.stream_stats()
+            result.update({'period': period, 'samplerate': samplerate})
+            queue.put(result)
+
+
+def carla_startup_case(proj_path, servername, queue):
+    carla = Carla(proj_path, ['-d', 'dummy'],
+                  server_name=servername,
+                  probe=True)
+    carla.start()
+    queue.put({'carla_project': proj_path, 'startup_time': carla.startup_time})
+    carla.kill()
+
+
+def run_in_process(target, *args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=target, args=args + (queue, ))
+    process.start()
+    process.join()
+    if queue.empty():
+        return {'error': f'{target.__name__}{args} failed'}
+    return queue.get()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        description="Benchmark the freewheel render path")
+    argparser.add_argument("--periods",
+                           type=int,
+                           nargs='+',
+                           default=[64, 256, 1024],
+                           help="Jack period sizes to test")
+    argparser.add_argument("--samplerate", type=int, default=48000)
+    argparser.add_argument("--duration",
+                           type=float,
+                           default=60,
+                           help="Seconds of audio rendered in each case")
+    argparser.add_argument(
+        "--jobs",
+        type=int,
+        default=100,
+        help="Short renders in each turnaround case (0 to skip)")
+    argparser.add_argument(
+        "--stream-seconds",
+        type=float,
+        default=5,
+        help="Seconds of realtime streaming in each case (0 to skip)")
+    argparser.add_argument(
+        "--carla",
+        default=None,
+        help="Path to a Carla project; if given, measures Carla startup time")
+    argparser.add_argument("--output",
+                           default=None,
+                           help="JSON file to write (default: stdout)")
+    args = argparser.parse_args()
+
+    results = []
+    for period in args.periods:
+        print(f"Rendering with period {period}...")
+        results.append(
+            run_in_process(render_case, period, args.samplerate,
+                           args.duration, f"pycarla-bench-{period}"))
+    turnaround = []
+    if args.jobs > 0:
+        for period in args.periods:
+            print(f"Rendering {args.jobs} short jobs with period {period}...")
+            turnaround.append(
+                run_in_process(turnaround_case, period, args.samplerate,
+                               args.jobs, f"pycarla-bench-jobs-{period}"))
+    streams = []
+    if args.stream_seconds > 0:
+        for period in args.periods:
+            print(f"Streaming with period {period}...")
+            streams.append(
+                run_in_process(stream_case, period, args.samplerate,
+                               args.stream_seconds,
+                               f"pycarla-bench-stream-{period}"))
+    startup = None
+    if args.carla:
+        startup = run_in_process(carla_startup_case, args.carla,
+                                 "pycarla-bench-carla")
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'render': results,
+        'turnaround': turnaround,
+        'stream': streams,
+        'carla_startup': startup
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,34 @@
-from .utils import get_smf_duration
-from .jackserver import JackServer
-from .carla import Carla
-from .audiorecorder import AudioRecorder
-from .midiplayer import MIDIPlayer
+import importlib
+
+# the Jack library is loaded only when one of these is used, so that modules
+# not talking to Jack (e.g. `pycarla.schedule` or `pycarla.journal`) can be
+# imported without it
+_exports = {
+    'get_smf_duration': 'utils',
+    'JackServer': 'jackserver',
+    'Carla': 'carla',
+    'AudioRecorder': 'audiorecorder',
+    'MIDIPlayer': 'midiplayer',
+    'Renderer': 'renderer',
+    'render': 'batch',
+    'synthesize_many': 'batch',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module('.' + _exports[name], __name__)
+        return getattr(module, name)
+    try:
+        # submodules, e.g. `pycarla.schedule` after `import pycarla`
+        return importlib.import_module('.' + name, __name__)
+    except ModuleNotFoundError as e:
+        if e.name != __name__ + '.' + name:
+            raise
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
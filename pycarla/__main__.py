@@ -38,7 +38,11 @@ recorder = AudioRecorder()
 player = MIDIPlayer()
 print("Playing and recording full file in freewheeling mode..")
 duration = get_smf_duration(filename)
-recorder.start(duration + FINAL_DECAY, sync=False)
+# FINAL_DECAY is the maximum decay: recording ends when the output is silent
+recorder.start(duration + FINAL_DECAY,
+               sync=False,
+               silence_threshold=1e-4,
+               after=lambda: player.end_wait.is_set())
 server.toggle_freewheel()
 player.synthesize_midi_file(filename, sync=True, progress=True)
 recorder.wait()
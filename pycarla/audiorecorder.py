@@ -1,42 +1,94 @@
-import threading
+import time
 
+import jack
 import numpy as np
 import soundfile as sf
 
+from .buffers import ArrayBuffer, RingBuffer, StreamWriter
 from .generics import JackClient
 
+# the cffi objects of jack-client, used to copy port buffers with memmove
+_ffi = getattr(jack, '_ffi', None)
+_lib = getattr(jack, '_lib', None)
+
 
 class AudioRecorder(JackClient):
     AUDIO_PORT = 'Carla'
 
-    def __init__(self):
+    def __init__(self,
+                 servername=None,
+                 profile=False,
+                 persistent=False,
+                 port_groups=None):
         """
         Records output from a Carla instance.
 
-        For now, only one Carla instance should be active.
+        For now, only one Carla instance should be active in each Jack
+        server; `servername` selects the server (see `Carla`).
+
+        If `profile` is True, process callbacks are timed (see
+        ``JackClient.stats``). If `persistent` is True, ports stay connected
+        between recordings (see ``JackClient``).
+
+        By default, all the audio output ports matching `AUDIO_PORT` are
+        recorded. To capture more plugins at once (e.g. in a Carla
+        patchbay), `port_groups` maps group names to port name patterns: all
+        the groups are recorded in the same cycles, in one array whose
+        channels follow the order of the groups; use `grouped` to get one
+        array per group.
 
         If the Carla instance is not found, this method raises a
         `RuntimeWarning`. To avoid it, use ``Carla.exists`` method. Note that
         ``Carla.start`` already does that!
         """
-        super().__init__("AudioRecorder")
+        super().__init__("AudioRecorder", servername, profile, persistent)
+        self.port_groups = port_groups
+        self.recorded = []
+        # the channels of each group
+        self.groups = {}
+        self._needed_samples = -1
+        self._buffer = None
+        self._stream = None
+        self._stream_to = None
+        self._ring = None
+        self._ring_frames = None
+        self._layout = 'channels'
+        self._compensate_latency = False
+        self._skip = 0
+        self.latency = 0
+        self.recorded_frames = 0
+        self.overflows = 0
+        # destination pointers of the memmove capture and the array they
+        # point to
+        self._pointers = []
+        self._pointers_data = None
 
-    def activate(self):
+    def _connect(self):
         """
-        Activate the recording client and set the connections.
-        Set self.channels and create one input port per each Carla output port.
+        Activate the recording client and set the connections: set
+        `self.channels` and create one input port per each Carla output port.
+        The latency of the Carla ports is stored in `self.latency`.
 
         If the Carla instance is not found, this method rase a
         `RuntimeWarning`. To avoid it, use ``Carla.exists`` method. Note that
         ``Carla.start`` already does that!
         """
         # get default values and params
-        carla_ports = self.client.get_ports(self.AUDIO_PORT,
-                                            is_audio=True,
-                                            is_output=True)
-        if len(carla_ports) == 0:
-            raise RuntimeWarning(
-                "Cannot find the Carla instance, Retry later!")
+        port_groups = self.port_groups
+        if port_groups is None:
+            port_groups = {self.AUDIO_PORT: self.AUDIO_PORT}
+        carla_ports = []
+        self.groups = {}
+        for name, pattern in port_groups.items():
+            ports = self.client.get_ports(pattern,
+                                          is_audio=True,
+                                          is_output=True)
+            if len(ports) == 0:
+                raise RuntimeWarning(
+                    "Cannot find the Carla instance, Retry later!")
+            self.groups[name] = slice(len(carla_ports),
+                                      len(carla_ports) + len(ports))
+            carla_ports += ports
         self.channels = len(carla_ports)
         self.ports = []
         self.client.activate()
@@ -46,7 +98,38 @@ class AudioRecorder(JackClient):
             if not inp.is_connected_to(p):
                 self.client.connect(p, inp)
             self.ports.append(inp)
-        self.is_active = True
+        self.latency = self.get_latency(carla_ports)
+
+    def _prepare(self):
+        """
+        Allocate the buffer that will hold the recording (or open the file it
+        will be streamed to)
+        """
+        if self._needed_samples > 0:
+            # one more block because the recording stops after having
+            # exceeded the needed samples
+            frames = self._needed_samples + self.client.blocksize
+        else:
+            frames = None
+        if self._ring_frames is not None:
+            self._ring = RingBuffer(self.channels, self._ring_frames)
+        elif self._stream_to is not None:
+            self._stream = StreamWriter(self._stream_to, self.channels,
+                                        self.client.samplerate)
+        else:
+            self._buffer = ArrayBuffer(self.channels,
+                                       frames,
+                                       layout=self._layout)
+        self._skip = self.latency if self._compensate_latency else 0
+
+    @staticmethod
+    def get_latency(ports):
+        """
+        Returns the maximum capture latency in frames of `ports`, i.e. the
+        number of frames that a signal takes to get to them, as reported by
+        Jack (e.g. the latency of the plugins loaded in Carla)
+        """
+        return max(p.get_latency_range(jack.CAPTURE)[1] for p in ports)
 
     def clear(self):
         """
@@ -54,32 +137,81 @@ class AudioRecorder(JackClient):
         """
         del self.recorded
         self.recorded = []
+        self._buffer = None
+        self._pointers = []
+        self._pointers_data = None
 
     def start(self,
               duration=None,
               sync=False,
               condition=lambda: True,
+              stream_to=None,
+              ring_frames=None,
+              layout='channels',
+              compensate_latency=False,
+              silence_threshold=None,
+              silence_window=0.5,
+              after=lambda: True,
               **kwargs):
         """
         Record audio for ``duration`` seconds. Note that this function blocks
         if `sync` is True, otherwise, this returns suddenly and you
         should wait/stop by calling the `wait` method of this object which
-        constructs the recorded array in `self.recorded`
+        exposes the recorded array in `self.recorded`
+
+        Blocks are copied in a buffer preallocated from `duration`; if
+        `duration` is None, the buffer grows in large chunks. `layout` is the
+        layout of the recorded array: ``'channels'`` for `(channels, frames)`,
+        ``'frames'`` for `(frames, channels)`.
+
+        If `stream_to` is a file name, blocks are not kept in memory: they are
+        pushed in a ring buffer that a writer thread drains into the file,
+        which is finalized by `wait`; `recorded` stays empty. Blocks that find
+        the ring buffer full are counted in `overflows` and dropped, unless
+        Jack is freewheeling, in which case the callback waits for the writer.
+
+        Similarly, if `ring_frames` is not None, blocks are pushed in a
+        `RingBuffer` of `ring_frames` frames, to be consumed while recording
+        with `iter_blocks` instead of `wait`.
+
+        If `compensate_latency` is True, the first `self.latency` frames are
+        not recorded, so that the recording starts with the first frame
+        produced by Carla in response to the MIDI input.
+
+        If `silence_threshold` is not None, the recording ends once the RMS of
+        all the channels has been below `silence_threshold` for
+        `silence_window` seconds (plus `self.latency` frames) since `after()`
+        became True; `duration` becomes the maximum duration. Use
+        ``after=lambda: player.end_wait.is_set()`` to end after the last MIDI
+        message of a `MIDIPlayer` (the player creates a new `end_wait` at each
+        job).
 
         `condition` is a function checked in the recording callback. If
         `condition()` is False, blocks are discarded. The callback start
         recording at the cycle after the one in which `condition()` becomes
-        True.
+        True; after that, `condition` is not checked anymore, so that the
+        recording goes on once the player ended its job.
 
         This function is compatible with Jack freewheeling mode to record
         offline sessions.
 
         `kwargs` are passed to `wait` if `sync` is True.
         """
-        global callback
         self.recorded = []
-        self.ready_at = -1
-        self.end_wait = threading.Event()
+        self._buffer = None
+        self._stream_to = stream_to
+        self._ring = None
+        self._ring_frames = ring_frames
+        self._layout = layout
+        self._compensate_latency = compensate_latency
+        self.recorded_frames = 0
+        # silent frames since `after()` became True, -1 before
+        self._silent_frames = -1
+        self._new_job()
+
+        if silence_threshold is not None:
+            silence_energy = silence_threshold**2
+            silence_frames = int(silence_window * self.client.samplerate)
 
         if duration is not None:
             self._needed_samples = int(duration * self.client.samplerate)
@@ -87,27 +219,103 @@ class AudioRecorder(JackClient):
             # values <= 0 causes the `end_wait` never being set
             self._needed_samples = -1
 
-        @self.client.set_process_callback
+        # copy with memmove when the channels of the buffer are contiguous
+        fast = _lib is not None and layout == 'channels'
+
+        def freewheeling():
+            # checked while waiting for the consumer of the ring buffer
+            return self.freewheeling
+
         def callback(frames):
-            channels = [i.get_array() for i in self.client.inports]
-            if len(channels) == self.channels:
+            if self.is_active and len(self.client.inports) == self.channels:
                 if not self.is_ready():
                     # let other clients know that this is ready
                     print(self.client.name + " ready!")
                     self.ready_at = self.client.last_frame_time
-                elif condition():
+                elif self.started_at >= 0 or condition():
                     # start only if other clients are ready too
-                    self.recorded.append(np.stack(channels))
+                    self.start_processing()
+                    skip = self._skip
+                    if skip >= frames:
+                        # still in the latency
+                        self._skip -= frames
+                        return
+                    self._skip = 0
+                    arrays = None
+                    if self._buffer is not None and fast:
+                        self._capture(frames, skip)
+                    elif self._buffer is not None:
+                        arrays = [p.get_array() for p in self.ports]
+                        self._buffer.write((a[skip:] for a in arrays),
+                                           frames - skip)
+                    elif self._stream is not None:
+                        arrays = [p.get_array() for p in self.ports]
+                        blocks = (a[skip:] for a in arrays)
+                        self._stream.write(blocks,
+                                           frames - skip,
+                                           wait=freewheeling)
+                    else:
+                        arrays = [p.get_array() for p in self.ports]
+                        # `iter_blocks` doesn't read beyond `duration`
+                        n = frames - skip
+                        needed = self._needed_samples
+                        if needed > 0:
+                            n = min(n, needed - self.recorded_frames)
+                        if n > 0:
+                            blocks = (a[skip:skip + n] for a in arrays)
+                            self._ring.write(blocks, n, wait=freewheeling)
+                    self.recorded_frames += frames - skip
                     if self._needed_samples > 0:
-                        recorded_frames = self.client.last_frame_time -\
-                            self.ready_at
-                        if recorded_frames > self._needed_samples:
+                        if self.recorded_frames >= self._needed_samples:
                             self.end_wait.set()
+                    if silence_threshold is None:
+                        return
+                    if self._silent_frames < 0:
+                        # count silence only from when `after()` is True
+                        if after():
+                            self._silent_frames = 0
+                        return
+                    if arrays is None:
+                        arrays = [p.get_array() for p in self.ports]
+                    energy = max(np.dot(a, a) for a in arrays) / frames
+                    if energy < silence_energy:
+                        self._silent_frames += frames
+                    else:
+                        self._silent_frames = 0
+                    # Carla answers to the last events `latency` frames later
+                    if self._silent_frames >= silence_frames + self.latency:
+                        self.end_wait.set()
 
         self.activate()
+        self.set_process_callback(callback)
         if sync:
             self.wait(**kwargs)
 
+    def _capture(self, frames, skip):
+        """
+        Copies the port buffers at the end of the recording buffer with one
+        ``memmove`` per channel, without creating NumPy arrays.
+
+        Jack may move port buffers between cycles, so their addresses are
+        asked at each cycle; destination pointers are computed again only
+        when the recording buffer grows.
+        """
+        buffer = self._buffer
+        buffer.reserve(frames - skip)
+        if buffer.data is not self._pointers_data:
+            self._pointers_data = buffer.data
+            self._pointers = [
+                _ffi.cast('float *', _ffi.from_buffer(row))
+                for row in buffer.data
+            ]
+        length = buffer.length
+        nbytes = (frames - skip) * 4
+        for port, dest in zip(self.ports, self._pointers):
+            src = _ffi.cast('float *',
+                            _lib.jack_port_get_buffer(port._ptr, frames))
+            _ffi.memmove(dest + length, src + skip, nbytes)
+        buffer.length = length + frames - skip
+
     def wait(self, timeout=None, in_fw=False, out_fw=False):
         """
         Wait until recording is finished. If `timeout` is a number, it should
@@ -117,22 +325,152 @@ class AudioRecorder(JackClient):
 
         The recording stops when `timeout` or the duration passed when calling
         `start` is reached. In these cases, the recording client is deactivated
-        and the callback stopped.
+        and the callback stopped. If recording with `stream_to`, the file is
+        finalized here.
 
         waits while setting freewheeling mode to `in_fw`
         it then set freewheeling mode to `out_fw` before exiting
         """
         assert timeout is not None or self._needed_samples > 0, "Please, provide one between`timeout` and `duration`"
-        out = super().wait(timeout, in_fw, out_fw)
-        if len(self.recorded) > 0:
-            try:
-                self.recorded = np.concatenate(self.recorded, axis=1)
-            except Exception:
-                print(
-                    "Cannot concatenate the recorded blocks in one array, have you changed the number of channels while recording? In the `AudioRecorder.recorded` you will find the list of recorded blocks"
-                )
+        return super().wait(timeout, in_fw, out_fw)
+
+    async def await_done(self, timeout=None, in_fw=False, out_fw=False):
+        """
+        Same as `wait`, but awaitable (see ``JackClient.await_done``)
+        """
+        assert timeout is not None or self._needed_samples > 0, "Please, provide one between`timeout` and `duration`"
+        return await super().await_done(timeout, in_fw, out_fw)
+
+    def _finish(self, success, out_fw):
+        if self._ring is not None:
+            # before stopping the callback, which may be waiting for the
+            # consumer of the ring
+            self._ring.close()
+        out = super()._finish(success, out_fw)
+        if self._buffer is not None:
+            self.recorded = self._buffer.array
+        if self._stream is not None:
+            self.overflows = self._stream.overflows
+            self._stream.close()
+            self._stream = None
+        if self._ring is not None:
+            self.overflows = self._ring.overflows
         return out
 
+    def iter_blocks(self,
+                    block_frames=4096,
+                    timeout=None,
+                    in_fw=False,
+                    out_fw=False,
+                    poll=0.001):
+        """
+        A generator of `(channels, block_frames)` float32 arrays, yielded
+        while recording; it replaces `wait` when `start` was called with
+        `ring_frames`. The last block can be shorter and no more than the
+        `duration` passed to `start` is yielded.
+
+        Blocks are views of the ring buffer (or of a preallocated scratch
+        array when they wrap around it) and are valid until the next
+        iteration: copy them if you need to keep them. Since frames are
+        released only when the consumer asks for the next block, memory stays
+        bounded by the ring size.
+
+        While Jack is freewheeling, the process callback waits for the
+        consumer when the ring is full (backpressure); otherwise, blocks that
+        find it full are dropped and counted in `overflows`.
+
+        Freewheeling mode is set to `in_fw` while iterating and to `out_fw`
+        at the end; the ring is polled every `poll` seconds. If `timeout` is
+        a number, the iteration ends after `timeout` seconds.
+
+        Example
+        -------
+
+        .. code-block:: python
+
+            recorder.start(duration, condition=player.is_ready,
+                           ring_frames=2**18)
+            player.synthesize_midi_file("file.mid",
+                                        condition=recorder.is_ready)
+            for block in recorder.iter_blocks(4096, in_fw=True):
+                features.append(extract(block))
+        """
+        ring = self._ring
+        if ring is None:
+            raise RuntimeError("Call `start` with `ring_frames` first!")
+        if block_frames > ring.capacity:
+            raise ValueError("`block_frames` is larger than the ring buffer")
+        scratch = np.empty((self.channels, block_frames), dtype=np.float32)
+        needed = self._needed_samples
+        yielded = 0
+        success = True
+        start = time.time()
+        self.set_freewheel(in_fw)
+        try:
+            while True:
+                frames = block_frames
+                if needed > 0:
+                    frames = min(frames, needed - yielded)
+                    if frames <= 0:
+                        break
+                done = self.end_wait.is_set()
+                available = ring.available
+                if available >= frames or (done and available > 0):
+                    segments = ring.peek(frames)
+                    if len(segments) == 1:
+                        block = segments[0]
+                    else:
+                        split = segments[0].shape[1]
+                        end = split + segments[1].shape[1]
+                        scratch[:, :split] = segments[0]
+                        scratch[:, split:end] = segments[1]
+                        block = scratch[:, :end]
+                    yield block
+                    ring.advance(block.shape[1])
+                    yielded += block.shape[1]
+                elif done:
+                    break
+                elif timeout is not None and time.time() - start >= timeout:
+                    success = False
+                    break
+                else:
+                    self.end_wait.wait(poll)
+        finally:
+            self._finish(success, out_fw)
+
+    def grouped(self, recorded=None):
+        """
+        Returns a dict mapping the name of each port group (`port_groups`)
+        to a view of the channels of `recorded` (default: `self.recorded`)
+        that belong to it. Without `port_groups`, the only group is named as
+        `AUDIO_PORT`.
+        """
+        if recorded is None:
+            recorded = self.recorded
+        if self._layout == 'channels':
+            return {name: recorded[s] for name, s in self.groups.items()}
+        return {name: recorded[:, s] for name, s in self.groups.items()}
+
+    def trimmed(self, start=0, silence_threshold=None):
+        """
+        Returns the recorded array as a C-contiguous array without the first
+        `start` frames and, if `silence_threshold` is not None, without the
+        trailing frames whose absolute value is below `silence_threshold`.
+
+        Trimming is done in place in the recording buffer (see
+        ``ArrayBuffer.compact``), so `recorded` is not valid anymore after
+        this call.
+        """
+        if self._buffer is None:
+            raise RuntimeError("No recorded array!")
+        stop = self._buffer.length
+        if silence_threshold is not None:
+            stop = self._buffer.last_above(silence_threshold)
+        stop = max(start, stop)
+        self.recorded = self._buffer.compact(start, stop)
+        self._buffer = None
+        return self.recorded
+
     def save_recorded(self, filename):
         """
         Save the recorded array to file. Extensions supported by
@@ -145,7 +483,10 @@ class AudioRecorder(JackClient):
         if not hasattr(self, 'recorded'):
             raise RuntimeError("No recorded array!")
 
-        recorded = self.recorded.T
+        if self._layout == 'channels':
+            recorded = self.recorded.T
+        else:
+            recorded = self.recorded
         try:
             sf.write(str(filename), recorded, int(self.client.samplerate))
         except Exception:
@@ -0,0 +1,254 @@
+import itertools
+import os
+import time
+
+from .audiorecorder import AudioRecorder
+from .cache import get_schedule
+from .carla import Carla
+from .journal import Journal, journaled
+from .midiplayer import MIDIPlayer
+from .schedule import EventSchedule
+
+# numbers the private Jack servers started by `render`
+_servers = itertools.count()
+
+
+def render_file(player,
+                recorder,
+                path,
+                out,
+                decay=4,
+                stream=False,
+                on_xrun='rerender',
+                max_attempts=3,
+                silence_threshold=None,
+                compensate_latency=False):
+    """
+    Synthesize one MIDI file at `path` to the audio file `out` using the
+    given (already created) `player` and `recorder`. Freewheel is left on
+    when the render ends.
+
+    A render is corrupted if any xrun happened while the player or the
+    recorder were processing, or if they didn't start in the same cycle.
+    `on_xrun` sets what to do in that case: ``'rerender'`` renders again, up
+    to `max_attempts` times in total, ``'fail'`` marks the render as not
+    successful and ``'ignore'`` keeps it.
+
+    `decay`, `stream`, `silence_threshold` and `compensate_latency` are as
+    in `synthesize_many`; the returned dict is described there too.
+    """
+    if on_xrun not in ['rerender', 'fail', 'ignore']:
+        raise ValueError("`on_xrun` must be 'rerender', 'fail' or 'ignore'")
+
+    start = time.time()
+    schedule = get_schedule(path)
+    duration = schedule.duration + decay
+    parse_time = time.time() - start
+
+    for attempt in range(1, max_attempts + 1):
+        start = time.time()
+        recorder.start(duration,
+                       condition=player.is_ready,
+                       stream_to=out if stream else None,
+                       compensate_latency=compensate_latency,
+                       silence_threshold=silence_threshold,
+                       after=lambda: player.end_wait.is_set())
+        player.synthesize_messages(schedule, condition=recorder.is_ready)
+        success = player.wait(in_fw=True, out_fw=True)
+        success = recorder.wait(in_fw=True, out_fw=True) and success
+        render_time = time.time() - start
+        recorded = recorder.recorded_frames / recorder.client.samplerate
+        xruns = max(player.render_xruns(), recorder.render_xruns())
+        corrupted = xruns > 0 or player.started_at != recorder.started_at
+        if not corrupted or on_xrun != 'rerender':
+            break
+        print(f"Render of {path} corrupted by {xruns} xruns, rendering again")
+
+    if corrupted and on_xrun != 'ignore':
+        success = False
+    if not stream:
+        # so that a failed save doesn't leave the output of an older render
+        if os.path.exists(out):
+            os.remove(out)
+        recorder.save_recorded(out)
+    if not os.path.isfile(out) or os.path.getsize(out) == 0:
+        # `save_recorded` only prints its errors
+        print("No audio written to " + str(out))
+        success = False
+
+    if not success:
+        print("Error while synthesizing " + str(path))
+    return {
+        'midi': path,
+        'audio': out,
+        'success': success,
+        'duration': recorded,
+        'parse_time': parse_time,
+        'render_time': render_time,
+        'realtime_factor': recorded / render_time,
+        'xruns': xruns,
+        'attempts': attempt
+    }
+
+
+def output_path(path, out_dir, ext):
+    """
+    The path in `out_dir` with the same name as the file at `path` and
+    extension `ext`
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(out_dir, name + ext)
+
+
+def output_jobs(midi_paths, out_dir, ext):
+    """
+    The `(midi_path, output_path)` pair of each file in `midi_paths` (see
+    `output_path`). Raises `ValueError` if two files would be saved to the
+    same path (e.g. ``a/x.mid`` and ``b/x.mid``), before of rendering
+    anything.
+    """
+    jobs = [(path, output_path(path, out_dir, ext)) for path in midi_paths]
+    sources = {}
+    for path, out in jobs:
+        key = os.path.normcase(os.path.abspath(out))
+        if key in sources:
+            raise ValueError(f"{sources[key]} and {path} would both be "
+                             f"saved to {out}: rename one of them")
+        sources[key] = path
+    return jobs
+
+
+def synthesize_many(carla,
+                    midi_paths,
+                    out_dir,
+                    decay=4,
+                    ext='.wav',
+                    stream=False,
+                    on_xrun='rerender',
+                    max_attempts=3,
+                    silence_threshold=None,
+                    compensate_latency=False,
+                    journal=None,
+                    retries=0,
+                    backoff=1):
+    """
+    Synthesize many MIDI files in freewheeling mode with the same `Carla`
+    instance, which should be already started.
+
+    One `MIDIPlayer` and one `AudioRecorder` are created and reused for all
+    the files, staying connected to Carla (see ``JackClient``), and freewheel
+    is kept on for the whole job, so that files are rendered back-to-back.
+    Each recording lasts the duration of the MIDI file plus `decay` seconds;
+    if `silence_threshold` is not None, recordings end as soon as the output
+    stays below it for half a second after the last MIDI message, and
+    `decay` is the maximum decay. If `compensate_latency` is True, the
+    latency reported by Carla is dropped from the beginning of each
+    recording (see ``AudioRecorder.start``).
+
+    Each file is saved in `out_dir` with the same name as the MIDI file and
+    extension `ext`; files with the same name are not allowed (see
+    `output_jobs`). If `stream` is True, files are streamed to disk while
+    recording (see ``AudioRecorder.start``).
+
+    Renders corrupted by xruns are handled according to `on_xrun` and
+    `max_attempts` (see `render_file`). Failed renders (e.g. because Carla
+    crashed and is being restarted by its watchdog) are tried again up to
+    `retries` times, waiting ``backoff * 2**(i - 1)`` seconds before of the
+    `i`-th retry.
+
+    If `journal` is a `pycarla.journal.Journal` (or the path of one), each
+    attempt is appended to it and files whose output is already done are
+    skipped, so that an interrupted batch can be resumed by calling this
+    function again with the same journal.
+
+    To render on more Jack servers in parallel, see `pycarla.pool.RenderPool`.
+
+    Returns
+    -------
+    list[dict] :
+        one dict per file rendered (skipped files are not included), with
+        keys `midi`, `audio`, `success`, `duration` (seconds of audio),
+        `parse_time`, `render_time` (seconds of wall time), `realtime_factor`
+        (`duration` / `render_time`), `xruns` (in the last attempt),
+        `attempts` and `retries`; if an exception was raised, only `midi`,
+        `audio`, `success`, `retries` and `error`
+    """
+    jobs = output_jobs(midi_paths, out_dir, ext)
+    os.makedirs(out_dir, exist_ok=True)
+    if isinstance(journal, (str, os.PathLike)):
+        journal = Journal(journal)
+    with MIDIPlayer(carla.server_name, persistent=True) as player,\
+            AudioRecorder(carla.server_name, persistent=True) as recorder:
+
+        def render_one(path, out):
+            carla.wait_exists(carla.READY_TIMEOUT)
+            return render_file(player, recorder, path, out, decay, stream,
+                               on_xrun, max_attempts, silence_threshold,
+                               compensate_latency)
+
+        recorder.set_freewheel(True)
+        try:
+            return journaled(render_one, jobs, journal, retries, backoff)
+        finally:
+            recorder.set_freewheel(False)
+
+
+def render(midi,
+           preset,
+           decay=4,
+           layout='channels',
+           latency=0,
+           silence_threshold=None,
+           compensate_latency=True,
+           server_options=['-d', 'dummy']):
+    """
+    Synthesize `midi` (a path, a ``mido.MidiFile`` or an `EventSchedule`) in
+    freewheeling mode and return the audio as a C-contiguous float32 array,
+    without writing any file.
+
+    `preset` is either a started `Carla` instance or the path to a Carla
+    project; in the latter case, a `Carla` is started on a private Jack server
+    with `server_options` and a unique name, so that the default server is
+    never touched, waiting until it produces sound, and killed at the end.
+
+    `layout` is ``'channels'`` for a `(channels, frames)` array and
+    ``'frames'`` for a `(frames, channels)` array.
+
+    If `compensate_latency` is True, the latency reported by Carla is not
+    recorded; the first `latency` frames are dropped too. If
+    `silence_threshold` is not None, the recording ends once the output stays
+    below it after the last MIDI message (`decay` is then the maximum decay)
+    and trailing frames below it are dropped. Trimming is done in place,
+    without copying the recording into a new array.
+    """
+    if isinstance(midi, EventSchedule):
+        schedule = midi
+    else:
+        schedule = get_schedule(midi)
+
+    if isinstance(preset, Carla):
+        carla = preset
+    else:
+        carla = Carla(preset,
+                      server_options,
+                      server_name=f"pycarla-render-{os.getpid()}-"
+                      f"{next(_servers)}",
+                      probe=True)
+        carla.start()
+    try:
+        with MIDIPlayer(carla.server_name) as player,\
+                AudioRecorder(carla.server_name) as recorder:
+            recorder.start(schedule.duration + decay,
+                           condition=player.is_ready,
+                           layout=layout,
+                           compensate_latency=compensate_latency,
+                           silence_threshold=silence_threshold,
+                           after=lambda: player.end_wait.is_set())
+            player.synthesize_messages(schedule, condition=recorder.is_ready)
+            player.wait(in_fw=True, out_fw=True)
+            if not recorder.wait(in_fw=True, out_fw=False):
+                raise RuntimeError("Error while rendering")
+            return recorder.trimmed(latency, silence_threshold)
+    finally:
+        if carla is not preset:
+            carla.kill()
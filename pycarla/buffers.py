@@ -0,0 +1,342 @@
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+
+class ArrayBuffer:
+    def __init__(self,
+                 channels,
+                 frames=None,
+                 chunk_frames=2**21,
+                 layout='channels'):
+        """
+        A preallocated float32 array in which audio blocks are copied one
+        after the other.
+
+        If `frames` is known, the whole array is allocated here, once and for
+        all; otherwise, the array grows by `chunk_frames` frames every time it
+        is full (the default is ~44 seconds at 48 kHz).
+
+        `layout` is ``'channels'`` for a `(channels, frames)` array or
+        ``'frames'`` for a `(frames, channels)` array.
+        """
+        if layout not in ['channels', 'frames']:
+            raise ValueError("`layout` must be 'channels' or 'frames'")
+        self.channels = channels
+        self.chunk_frames = chunk_frames
+        self.layout = layout
+        if frames is None or frames <= 0:
+            frames = chunk_frames
+        self.data = self._empty(frames)
+        self.length = 0
+
+    def _empty(self, frames):
+        if self.layout == 'channels':
+            return np.empty((self.channels, frames), dtype=np.float32)
+        return np.empty((frames, self.channels), dtype=np.float32)
+
+    def _frames(self, data, start, stop):
+        if self.layout == 'channels':
+            return data[:, start:stop]
+        return data[start:stop]
+
+    @property
+    def capacity(self):
+        """
+        Number of frames that can be written without growing
+        """
+        return self.data.shape[1 if self.layout == 'channels' else 0]
+
+    def reserve(self, frames):
+        """
+        Makes room for `frames` more frames, growing the array by
+        `chunk_frames` steps if needed
+        """
+        needed = self.length + frames
+        capacity = self.capacity
+        if needed > capacity:
+            while capacity < needed:
+                capacity += self.chunk_frames
+            data = self._empty(capacity)
+            self._frames(data, 0, self.length)[...] = self.array
+            self.data = data
+
+    def write(self, blocks, frames):
+        """
+        Copies `frames` frames of each channel at the end of the buffer.
+        `blocks` is an iterable of 1D arrays, one per channel (e.g. the
+        ``get_array()`` of each port).
+        """
+        self.reserve(frames)
+        end = self.length + frames
+        if self.layout == 'channels':
+            for i, block in enumerate(blocks):
+                self.data[i, self.length:end] = block
+        else:
+            for i, block in enumerate(blocks):
+                self.data[self.length:end, i] = block
+        self.length = end
+
+    @property
+    def array(self):
+        """
+        A view of the written part of the buffer
+        """
+        return self._frames(self.data, 0, self.length)
+
+    def last_above(self, threshold, chunk=2**16):
+        """
+        Returns the index following the last frame in which any channel has an
+        absolute value greater than `threshold` (0 if there is none). The
+        buffer is scanned backwards in chunks of `chunk` frames.
+        """
+        stop = self.length
+        while stop > 0:
+            start = max(0, stop - chunk)
+            above = np.abs(self._frames(self.data, start, stop)) > threshold
+            if self.layout == 'channels':
+                above = np.any(above, axis=0)
+            else:
+                above = np.any(above, axis=1)
+            idx = np.flatnonzero(above)
+            if len(idx) > 0:
+                return start + idx[-1] + 1
+            stop = start
+        return 0
+
+    def compact(self, start=0, stop=None):
+        """
+        Moves frames from `start` to `stop` at the beginning of the underlying
+        memory and returns them as a C-contiguous array, without allocating
+        a new array. After this, the buffer should not be written anymore.
+
+        With the ``'frames'`` layout, this is just a view; with the
+        ``'channels'`` layout, channels are moved one by one.
+        """
+        if stop is None:
+            stop = self.length
+        if self.layout == 'frames':
+            return self.data[start:stop]
+        n = stop - start
+        flat = self.data.reshape(-1)
+        capacity = self.capacity
+        for c in range(self.channels):
+            if c * n != c * capacity + start:
+                flat[c * n:(c + 1) * n] = self.data[c, start:stop]
+        self.length = 0
+        return flat[:self.channels * n].reshape(self.channels, n)
+
+
+class RingBuffer:
+    def __init__(self, channels, frames):
+        """
+        A single-producer/single-consumer ring buffer of `(channels, frames)`
+        float32 samples.
+
+        The producer (the Jack process callback) only moves `written` and the
+        consumer only moves `read`, so no lock is needed on either side.
+        `overflows` counts the blocks that were dropped because the buffer was
+        full.
+
+        Once the consumer calls `close`, the producer never waits for it
+        anymore.
+        """
+        self.data = np.empty((channels, frames), dtype=np.float32)
+        self.capacity = frames
+        self.written = 0
+        self.read = 0
+        self.overflows = 0
+        self.closed = False
+
+    @property
+    def available(self):
+        """
+        Number of frames that can be read
+        """
+        return self.written - self.read
+
+    @property
+    def free(self):
+        """
+        Number of frames that can be written
+        """
+        return self.capacity - self.written + self.read
+
+    def write(self, blocks, frames, wait=False):
+        """
+        Copies `frames` frames of each channel in the buffer. `blocks` is an
+        iterable of 1D arrays, one per channel, and is not consumed if there
+        is no room for it.
+
+        If there is no room and `wait` is True, this waits for the consumer
+        (unless it is closed); otherwise, the block is dropped, `overflows` is
+        incremented and False is returned. `wait` can also be a function,
+        called again at each check (e.g. to stop waiting once Jack leaves
+        freewheeling mode).
+        """
+        while frames > self.free:
+            waiting = wait() if callable(wait) else wait
+            if not waiting or self.closed:
+                self.overflows += 1
+                return False
+            time.sleep(0.0005)
+        start = self.written % self.capacity
+        end = start + frames
+        for i, block in enumerate(blocks):
+            if end <= self.capacity:
+                self.data[i, start:end] = block
+            else:
+                split = self.capacity - start
+                self.data[i, start:] = block[:split]
+                self.data[i, :end - self.capacity] = block[split:]
+        self.written += frames
+        return True
+
+    def peek(self, frames=None):
+        """
+        Returns a list of (at most two) views covering the next `frames`
+        readable frames (all the available ones if `frames` is None), without
+        consuming them. Call `advance` once you're done with them.
+        """
+        available = self.available
+        if frames is None or frames > available:
+            frames = available
+        start = self.read % self.capacity
+        end = start + frames
+        if end <= self.capacity:
+            return [self.data[:, start:end]]
+        return [self.data[:, start:], self.data[:, :end - self.capacity]]
+
+    def advance(self, frames):
+        """
+        Marks `frames` frames as read, making room for the producer
+        """
+        self.read += frames
+
+    def close(self):
+        """
+        Tells the producer that nothing will be read anymore
+        """
+        self.closed = True
+
+
+class EventRing:
+    def __init__(self, capacity=1024, max_bytes=16):
+        """
+        A preallocated ring buffer of `capacity` timestamped MIDI events, each
+        one of at most `max_bytes` bytes.
+
+        For each event, the Jack frame time (`frames`) and the
+        ``time.perf_counter_ns`` (`times`) at which it was pushed are stored.
+
+        Producers can push from any thread, since `push` is serialized by a
+        lock; the only consumer (the Jack process callback) never takes it:
+        as in `RingBuffer`, producers only move `written` and the consumer only
+        moves `read`. `rows` holds one memoryview per slot, so that the
+        consumer can pass event bytes to Jack without copying them.
+        """
+        self.frames = np.zeros(capacity, dtype=np.int64)
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.sizes = np.zeros(capacity, dtype=np.int64)
+        self.data = np.zeros((capacity, max_bytes), dtype=np.uint8)
+        self.rows = [memoryview(row) for row in self.data]
+        self.capacity = capacity
+        self.written = 0
+        self.read = 0
+        self.overflows = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        """
+        Number of events that can be read
+        """
+        return self.written - self.read
+
+    def push(self, data, frame, time_ns):
+        """
+        Copies the bytes `data` in the next slot; returns False and
+        increments `overflows` if the ring is full. Raises `ValueError` if
+        `data` is longer than `max_bytes`.
+        """
+        size = len(data)
+        if size > self.data.shape[1]:
+            raise ValueError(f"MIDI events longer than {self.data.shape[1]} "
+                             "bytes are not supported")
+        with self._lock:
+            if self.written - self.read >= self.capacity:
+                self.overflows += 1
+                return False
+            i = self.written % self.capacity
+            self.data[i, :size] = np.frombuffer(data, dtype=np.uint8)
+            self.sizes[i] = size
+            self.frames[i] = frame
+            self.times[i] = time_ns
+            # publish the event only once it is complete
+            self.written += 1
+        return True
+
+
+class StreamWriter:
+    def __init__(self,
+                 filename,
+                 channels,
+                 samplerate,
+                 frames=2**20,
+                 interval=0.05,
+                 **kwargs):
+        """
+        Streams audio blocks to `filename` while they are recorded.
+
+        Blocks are pushed in a `RingBuffer` of `frames` frames by the Jack
+        process callback, while a writer thread wakes up every `interval`
+        seconds and drains it into an open ``soundfile.SoundFile`` with one
+        large write. Memory usage doesn't depend on the length of the
+        recording.
+
+        `kwargs` are passed to ``soundfile.SoundFile`` (e.g. `subtype`).
+        """
+        self.ring = RingBuffer(channels, frames)
+        self.file = sf.SoundFile(str(filename),
+                                 mode='w',
+                                 samplerate=int(samplerate),
+                                 channels=channels,
+                                 **kwargs)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def overflows(self):
+        return self.ring.overflows
+
+    def write(self, blocks, frames, wait=False):
+        """
+        Pushes one block per channel in the ring buffer; see
+        `RingBuffer.write`
+        """
+        return self.ring.write(blocks, frames, wait)
+
+    def _drain(self):
+        frames = 0
+        for segment in self.ring.peek():
+            self.file.write(segment.T)
+            frames += segment.shape[1]
+        self.ring.advance(frames)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._drain()
+
+    def close(self):
+        """
+        Stops the writer thread, writes the remaining frames and finalizes
+        the file
+        """
+        self._stop.set()
+        self._thread.join()
+        self._drain()
+        self.file.close()
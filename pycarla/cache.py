@@ -0,0 +1,152 @@
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+from .schedule import EventSchedule
+
+
+def default_directory():
+    """
+    ``$XDG_CACHE_HOME/pycarla`` or ``~/.cache/pycarla``
+    """
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pycarla')
+
+
+class ScheduleCache:
+    def __init__(self, directory=None, max_bytes=2**29):
+        """
+        An on-disk cache of compiled `EventSchedule` objects, one ``.npz``
+        file per MIDI file, named after the hash of its content.
+
+        Files are evicted in least-recently-used order once the cache
+        exceeds `max_bytes` (default 512 MiB). `directory` defaults to
+        `default_directory()` and is created when the first file is stored.
+
+        Writes are atomic, so more processes can share the same directory.
+        The size of the cache is computed once and then updated at each
+        stored file; the directory is scanned again only when it exceeds
+        `max_bytes`, so files stored by other processes are counted at the
+        next eviction.
+        """
+        if directory is None:
+            directory = default_directory()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # the size of the cache, None until the directory is scanned
+        self._size = None
+
+    @staticmethod
+    def key(path):
+        """
+        The sha256 of the content of the file at `path`
+        """
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**16), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, path):
+        """
+        Returns the `EventSchedule` of the MIDI file at `path`, compiling and
+        storing it if it is not in the cache
+        """
+        cached = self._path(self.key(path))
+        try:
+            with np.load(cached) as npz:
+                schedule = EventSchedule(npz['times'],
+                                         npz['data'].tobytes(),
+                                         npz['offsets'],
+                                         float(npz['duration']))
+        except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+            schedule = EventSchedule.from_midifile(str(path))
+            self._store(cached, schedule)
+        else:
+            # mark as recently used, unless another process evicted it
+            try:
+                os.utime(cached)
+            except FileNotFoundError:
+                pass
+        return schedule
+
+    def _store(self, cached, schedule):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f,
+                     times=schedule.times,
+                     data=np.frombuffer(schedule.data, dtype=np.uint8),
+                     offsets=schedule.offsets,
+                     duration=schedule.duration)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, cached)
+        if self._size is None:
+            self.evict()
+        else:
+            self._size += size
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used files until the cache is smaller than
+        `max_bytes`
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """
+        Removes all the files in the cache
+        """
+        max_bytes = self.max_bytes
+        self.max_bytes = -1
+        if os.path.exists(self.directory):
+            self.evict()
+        self.max_bytes = max_bytes
+
+
+default_cache = ScheduleCache()
+
+
+def get_schedule(midifile, cache=True):
+    """
+    Returns the `EventSchedule` of `midifile`, which can be a path or a
+    ``mido.MidiFile``.
+
+    Paths are looked up in `cache`: True means `default_cache`, False or None
+    disables caching, otherwise a `ScheduleCache` should be passed.
+    ``mido.MidiFile`` objects are always compiled.
+    """
+    if cache is True:
+        cache = default_cache
+    if isinstance(midifile, (str, os.PathLike)) and cache:
+        return cache.get(midifile)
+    return EventSchedule.from_midifile(midifile)
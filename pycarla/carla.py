@@ -1,22 +1,26 @@
 from typing import List
 import argparse
+import asyncio
 import fnmatch
 import os
 import platform
 import random
 import shutil
-import signal
 import sys
 import tarfile
+import threading
 import time
 import urllib.request
 
 import jack
 import mido
+import numpy as np
 
 import psutil
+from .audiorecorder import AudioRecorder
 from .jackserver import JackServer
-from .generics import ExternalProcess, FakeProcess
+from .generics import AsyncEvent, ExternalProcess, FakeProcess
+from .midiplayer import MIDIPlayer
 from .utils import progressbar, kill_psutil_process
 
 version = "2.1"
@@ -102,11 +106,19 @@ else:
 
 
 class Carla(ExternalProcess):
+    # Carla is considered ready when ports matching these exist
+    READY_PORTS = ["Carla:events*", "Carla:audio*"]
+    # seconds that renders wait for Carla to be ready (e.g. while the
+    # watchdog restarts it) before of failing
+    READY_TIMEOUT = 60
+
     def __init__(self,
                  proj_path: str,
                  server_options: List[str] = [],
                  min_wait: float = 0,
-                 nogui: bool = True):
+                 nogui: bool = True,
+                 server_name: str = None,
+                 probe: bool = False):
         """
         Creates a Carla object, ready to be started.
 
@@ -114,22 +126,40 @@ class Carla(ExternalProcess):
         `jackd`; the format is similar to `subprocess.Popen` -- e.g. ``['-d',
         'alsa', '-r', '48000']
 
+        * `server_name` is the name of the Jack server (see `JackServer`); use
+        different names to run more Carla instances at the same time, each
+        one in its own server. Clients that should connect to this instance
+        must be created with the same `servername`.
+
         * `min_wait` is the minimum amount of seconds waited when starting
         Carla; it is useful if your preset takes a bit to be loaded.
 
         * `nogui` is False if you want to use the gui
+
+        * `probe` is True if `start` should wait until Carla actually produces
+          sound (see `probe`) instead of waiting `min_wait` seconds
         """
         super().__init__()
 
         self.proj_path = proj_path
-        self.server = JackServer(server_options)
+        self.server = JackServer(server_options, server_name)
+        self.server_name = server_name
         self.min_wait = min_wait
+        self.probe_plugin = probe
+        self.startup_time = None
         if nogui:
             self.nogui = "-n"
         else:
             self.nogui = ""
 
         self.error = False
+        # watchdog counters: number of restarts and seconds elapsed between
+        # the first death signal and Carla being ready again for each of them
+        self.restarts = 0
+        self.detection_latencies = []
+        self.restart_latencies = []
+        self._stopping = False
+        self._died = threading.Event()
 
         if sys.platform == 'linux':
             if not os.path.exists(CARLA_PATH):
@@ -158,63 +188,233 @@ class Carla(ExternalProcess):
         self.start()
 
     def __make_carla_popen(self, proj_path):
+        env = None
+        if self.server_name is not None:
+            env = dict(os.environ, JACK_DEFAULT_SERVER=self.server_name)
         self.process = psutil.Popen(
             [CARLA_PATH + "Carla", self.nogui, proj_path],
-            preexec_fn=os.setsid)
+            preexec_fn=os.setsid,
+            env=env)
 
     def get_ports(self):
         return [port.name for port in self.client.get_ports()]
 
-    def start(self):
+    def __make_client(self):
+        self.client = jack.Client("pycarla", servername=self.server_name)
+        self._ready = AsyncEvent()
+        self._died = threading.Event()
+        self._registered = set()
+
+        # readiness is driven by Jack port registrations
+        @self.client.set_port_registration_callback
+        def port_registration(port, register):
+            if register:
+                self._registered.add(port.name)
+            else:
+                self._registered.discard(port.name)
+            if all(
+                    fnmatch.filter(self._registered, p)
+                    for p in self.READY_PORTS):
+                self._ready.set()
+
+        # a simple callback that signals the watchdog if carla disconnects;
+        # no work is done in the realtime thread
+        @self.client.set_client_registration_callback
+        def client_registration(name, register):
+            if name.startswith("Carla") and not register:
+                self.__signal_death(self._died)
+
+        self.client.activate()
+        # ports registered before of the activation
+        for port in self.client.get_ports():
+            port_registration(port, True)
+
+    def start(self, timeout=20):
         """
-        Start carla and Jack and wait `self.min_wait` seconds after a Carla
-        instance is ready.
+        Start carla and Jack and wait until a Carla instance is ready.
+
+        Readiness is detected through Jack port registration callbacks, so
+        this returns as soon as Carla has registered its ports. Then, if this
+        object was created with `probe`, it waits until `probe` succeeds,
+        otherwise it waits `self.min_wait` seconds.
+
+        If Carla is not ready after `timeout` seconds, both Carla and the
+        server are killed and restarted.
+
+        The seconds spent are stored in `self.startup_time`.
+
+        Once ready, a watchdog thread restarts Carla if its process exits or
+        if its Jack client unregisters; `self.restarts` counts the restarts
+        and, for each restart, `self.detection_latencies` stores the seconds
+        between the first death signal (process exit or client
+        unregistration) and the watchdog starting the restart, and
+        `self.restart_latencies` the seconds between the same signal and Carla
+        being ready again, i.e. how long clients had no Carla to talk to.
         """
-        self.server.start()
+        start = time.time()
+        while True:
+            self.server.start()
+            self.__launch()
+            if self._ready.wait(timeout) and self.process.is_running():
+                self.__start_watchdog()
+                break
+            self.__abort_launch(timeout)
 
-        if self.proj_path:
-            proj_path = os.path.abspath(self.proj_path)
+        if self.probe_plugin:
+            while not self.probe():
+                if time.time() - start >= timeout:
+                    print("Carla is not producing sound, go on anyway")
+                    break
         else:
-            proj_path = ""
+            time.sleep(self.min_wait)
+        self.__set_startup_time(start)
 
-        # starting Carla
-        self.__make_carla_popen(proj_path)
+    async def astart(self, timeout=20):
+        """
+        Same as `start`, but awaitable: the port registrations of Carla are
+        notified to the event loop by the Jack thread, so that one loop can
+        start many instances (each one in its own server) concurrently.
 
-        self.client = jack.Client("pycarla")
+        Example
+        -------
 
-        # a simple callback that restart carla if
-        # carla disconnects
-        @self.client.set_process_callback
-        def carla_process(frames):
-            if (self.client.last_frame_time // frames) % 8 == 0:
-                if not self.exists():
-                    print("Carla doesn't exists anymore, restarting it")
-                    self.restart_carla()
-                    self.error = True
+        .. code-block:: python
 
-        # waiting until Carla is ready
+            async def main():
+                async with Carla("piano.carxp", ['-d', 'dummy'],
+                                 server_name="piano") as carla:
+                    ...
+        """
         start = time.time()
-        READY = self.exists()
         while True:
-            if not READY and self.exists():
-                start = time.time()
-                READY = True
-            if time.time() - start >= self.min_wait and READY:
+            await self.server.astart()
+            self.__launch()
+            if await self._ready.wait_async(timeout) and\
+                    self.process.is_running():
+                self.__start_watchdog()
                 break
-            if time.time() - start >= 20:
-                self.kill_carla(sign=signal.SIGKILL)
-                self.server.restart()
-                self.__make_carla_popen()
-                start = time.time()
-            time.sleep(0.1)
-
-        # activate AFTER having started the Carla process
-        self.client.activate()
+            # killing waits for the processes to exit
+            await asyncio.get_event_loop().run_in_executor(
+                None, self.__abort_launch, timeout)
+
+        if self.probe_plugin:
+            while not await self.aprobe():
+                if time.time() - start >= timeout:
+                    print("Carla is not producing sound, go on anyway")
+                    break
+        else:
+            await asyncio.sleep(self.min_wait)
+        self.__set_startup_time(start)
+
+    async def __aenter__(self):
+        await self.astart()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.akill()
+
+    def __launch(self):
+        if self.proj_path:
+            proj_path = os.path.abspath(self.proj_path)
+        else:
+            proj_path = ""
+        self.__make_client()
+        # starting Carla AFTER having activated the client, so that all
+        # its port registrations are notified
+        self.__make_carla_popen(proj_path)
+
+    def __abort_launch(self, timeout):
+        print("Carla is not ready after " + str(timeout) +
+              " seconds, restarting it")
+        self.kill_carla()
+        self.server.kill()
+
+    def __set_startup_time(self, start):
+        self.startup_time = time.time() - start
+        print(f"Carla ready in {self.startup_time:.2f} seconds")
+
+    def __signal_death(self, died):
+        if not died.is_set():
+            self._death_time = time.time()
+            died.set()
+
+    def __wait_process(self, process, died):
+        try:
+            process.wait()
+        except Exception:
+            pass
+        self.__signal_death(died)
+
+    def __watchdog(self, died):
+        died.wait()
+        if died is not self._died or self._stopping:
+            # Carla was killed on purpose
+            return
+        death_time = self._death_time
+        self.detection_latencies.append(time.time() - death_time)
+        self.restarts += 1
+        print("Carla doesn't exists anymore, restarting it")
+        self.error = True
+        self.restart_carla()
+        # `start` returns once the new instance is ready
+        self.restart_latencies.append(time.time() - death_time)
+
+    def __start_watchdog(self):
+        """
+        Starts two threads: one waits for the Carla process to exit and one
+        restarts Carla when either the process exits or the Carla Jack client
+        unregisters.
+        """
+        self._stopping = False
+        for target, args in [(self.__wait_process, (self.process, self._died)),
+                             (self.__watchdog, (self._died, ))]:
+            threading.Thread(target=target, args=args, daemon=True).start()
+
+    def probe(self, pitch=60, velocity=100, duration=0.5):
+        """
+        Plays one note and returns True if Carla outputs any non-zero sample,
+        meaning that the plugins have been loaded.
+
+        The note is recorded in freewheeling mode, so this takes much less
+        than `duration` seconds.
+        """
+        with MIDIPlayer(self.server_name) as player,\
+                AudioRecorder(self.server_name) as recorder:
+            self.__start_probe(player, recorder, pitch, velocity, duration)
+            success = player.wait(timeout=10, in_fw=True, out_fw=True)
+            success = recorder.wait(timeout=10, in_fw=True,
+                                    out_fw=False) and success
+            return success and bool(np.any(recorder.recorded))
+
+    async def aprobe(self, pitch=60, velocity=100, duration=0.5):
+        """
+        Same as `probe`, but awaitable
+        """
+        with MIDIPlayer(self.server_name) as player,\
+                AudioRecorder(self.server_name) as recorder:
+            self.__start_probe(player, recorder, pitch, velocity, duration)
+            success = await player.await_done(timeout=10,
+                                              in_fw=True,
+                                              out_fw=True)
+            success = await recorder.await_done(
+                timeout=10, in_fw=True, out_fw=False) and success
+            return success and bool(np.any(recorder.recorded))
+
+    @staticmethod
+    def __start_probe(player, recorder, pitch, velocity, duration):
+        recorder.start(duration + 0.5, condition=player.is_ready)
+        player.synthesize_midi_note(pitch,
+                                    velocity,
+                                    duration,
+                                    condition=recorder.is_ready)
 
     def kill_carla(self):
         """
         kill carla, but not the server
         """
+        # stop the watchdog
+        self._stopping = True
+        self._died.set()
         self.client.deactivate()
         self.client.close()
         del self.client
@@ -231,7 +431,14 @@ class Carla(ExternalProcess):
             time.sleep(0.5)
         self.server.kill()
 
-    def exists(self, ports=["Carla:events*", "Carla:audio*"]):
+    async def akill(self):
+        """
+        Same as `kill`, but awaitable: processes are killed in the default
+        executor of the event loop, which is not blocked meanwhile
+        """
+        await asyncio.get_event_loop().run_in_executor(None, self.kill)
+
+    def exists(self, ports=READY_PORTS):
         """
         simply checks if the Carla process is running and ports are available
 
@@ -263,12 +470,43 @@ class Carla(ExternalProcess):
 
         return True
 
-    def wait_exists(self):
+    def memory_usage(self):
         """
-        Waits until a Carla instance is ready in Jack
+        Returns the resident memory in bytes of the Carla process and of its
+        children (e.g. plugin bridges)
         """
+        total = 0
+        try:
+            processes = [self.process] + self.process.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return 0
+        for p in processes:
+            try:
+                total += p.memory_info().rss
+            except (psutil.NoSuchProcess, AttributeError):
+                pass
+        return total
+
+    def wait_exists(self, timeout=None):
+        """
+        Waits until a Carla instance is ready in Jack, waking up when Carla
+        registers its ports
+
+        If `timeout` is a number and Carla is not ready after `timeout`
+        seconds, this raises `RuntimeError`.
+        """
+        start = time.time()
         while not self.exists():
-            time.sleep(0.5)
+            wait = 0.5
+            if timeout is not None:
+                wait = min(wait, start + timeout - time.time())
+                if wait <= 0:
+                    raise RuntimeError("Carla is not ready after " +
+                                       str(timeout) + " seconds")
+            # the watchdog makes a new event at each restart, while the one
+            # of a dead instance stays set
+            if self._ready.wait(wait):
+                time.sleep(0.01)
 
 
 if __name__ == "__main__":
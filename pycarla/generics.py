@@ -1,16 +1,174 @@
+import asyncio
 import jack
 import threading
 import time
+import numpy as np
 import psutil
 
 
+class CallbackProfile:
+    def __init__(self, samplerate, bins=64):
+        """
+        Timings of a process callback, collected without allocating memory in
+        the realtime thread.
+
+        `histogram[i]` counts the callbacks that lasted between ``2**(i-1)``
+        and ``2**i`` nanoseconds; `overruns` counts the callbacks that lasted
+        more than the period (`frames / samplerate`).
+        """
+        self.histogram = np.zeros(bins, dtype=np.int64)
+        self.ns_per_frame = 1e9 / samplerate
+        self.reset()
+
+    def reset(self):
+        self.histogram[:] = 0
+        self.count = 0
+        self.total_ns = 0
+        self.worst_ns = 0
+        self.overruns = 0
+        self.budget_ns = 0
+
+    def add(self, ns, frames):
+        """
+        Records one callback lasting `ns` nanoseconds for a period of `frames`
+        frames
+        """
+        self.histogram[min(ns.bit_length(), len(self.histogram) - 1)] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.worst_ns:
+            self.worst_ns = ns
+        self.budget_ns = frames * self.ns_per_frame
+        if ns > self.budget_ns:
+            self.overruns += 1
+
+    def stats(self):
+        """
+        Returns a dict with the number of callbacks, the mean and worst
+        duration in microseconds, the period budget in microseconds, the ratio
+        between the worst duration and the budget, the number of overruns and
+        the histogram as a list of (upper bound in microseconds, count) for
+        non-empty bins.
+        """
+        mean = self.total_ns / self.count if self.count > 0 else 0
+        budget = self.budget_ns
+        return {
+            'callbacks': self.count,
+            'mean_us': mean / 1e3,
+            'worst_us': self.worst_ns / 1e3,
+            'budget_us': budget / 1e3,
+            'worst_budget_ratio': self.worst_ns / budget if budget else 0,
+            'overruns': self.overruns,
+            'histogram': [(2**i / 1e3, int(c))
+                          for i, c in enumerate(self.histogram) if c > 0]
+        }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AsyncEvent(threading.Event):
+    """
+    A ``threading.Event`` that can also be awaited from asyncio event loops.
+
+    `set` can be called from any thread (e.g. the Jack threads): awaiting
+    coroutines are woken up with ``loop.call_soon_threadsafe``, so that no
+    thread is blocked waiting for the event.
+    """
+    def __init__(self):
+        super().__init__()
+        self._futures = []
+
+    def set(self):
+        super().set()
+        for loop, future in list(self._futures):
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def wait_async(self, timeout=None):
+        """
+        Same as `wait`, but awaitable. Returns False if `timeout` seconds
+        passed before of the event being set, True otherwise.
+        """
+        if self.is_set():
+            return True
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        item = (loop, future)
+        self._futures.append(item)
+        try:
+            # `set` may have been called before of the future being added
+            if self.is_set():
+                return True
+            await asyncio.wait_for(future, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._futures.remove(item)
+
+
 class JackClient:
-    def __init__(self, name):
-        self.client = jack.Client(name)
+    def __init__(self,
+                 name,
+                 servername=None,
+                 profile=False,
+                 persistent=False):
+        """
+        Base class of the Jack clients of pycarla.
+
+        Subclasses should set their process callback with
+        `set_process_callback` instead of using the underlying
+        ``jack.Client``; if `profile` is True, each callback is timed (see
+        `enable_profiling`).
+
+        If `persistent` is True, the client stays active and connected to
+        Carla at the end of each job: `wait` only swaps the process callback
+        with an idle one, and the next job only swaps it again, without
+        registering and connecting ports. Ports are connected again only if
+        Carla disconnects. Call `close` (or `deactivate`) at the end.
+        """
+        self.client = jack.Client(name, servername=servername)
         self.is_active = False
+        self.persistent = persistent
+        self.profile = None
+        self._process = None
+        # number of process callbacks completed
+        self._cycles = 0
+        # True if Carla disconnected after the ports were connected
+        self._stale = False
+        self._logger_stop = None
         self.ready_at = -1
-        self.end_wait = threading.Event()
+        self.started_at = -1
+        self.end_wait = AsyncEvent()
         self.error = False
+        self.freewheeling = False
+        # frame times at which xruns happened
+        self.xruns = []
+
+        @self.client.set_freewheel_callback
+        def freewheel_callback(starting):
+            self.freewheeling = starting
+
+        @self.client.set_xrun_callback
+        def xrun_callback(delayed_usecs):
+            self.xruns.append(self.client.last_frame_time)
+
+        @self.client.set_process_callback
+        def process(frames):
+            if self._process is None:
+                return
+            if self.profile is None:
+                self._process(frames)
+            else:
+                start = time.perf_counter_ns()
+                self._process(frames)
+                self.profile.add(time.perf_counter_ns() - start, frames)
+            self._cycles += 1
+
+        if profile:
+            self.enable_profiling()
 
         # a simple callback that ends the processing if
         # carla disconnects
@@ -19,12 +177,96 @@ class JackClient:
             if 'carla' in name.lower() and not register:
                 # this check works for both `pycarla` and `Carla-something`
                 print("Carla disconnected: disconnecting " + self.client.name)
+                self._stale = True
                 self.end_wait.set()
                 self.error = True
 
+    def set_process_callback(self, callback):
+        """
+        Sets the function called at each Jack cycle with the number of frames
+        as argument; it can be used as a decorator.
+        """
+        self._process = callback
+        return callback
+
+    def _idle(self, frames):
+        """
+        The process callback used between jobs
+        """
+        pass
+
+    def _new_job(self):
+        """
+        Makes the client idle and resets the state of the previous job; the
+        callback of the new job should be set with `set_process_callback`
+        only after `activate`
+        """
+        self.set_process_callback(self._idle)
+        self.ready_at = -1
+        self.started_at = -1
+        self.error = False
+        self.end_wait = AsyncEvent()
+
+    def _sync(self, timeout=1):
+        """
+        Waits until the process callback that is running, if any, returns
+        """
+        cycles = self._cycles
+        start = time.time()
+        while self._cycles == cycles and time.time() - start < timeout:
+            time.sleep(0.0001)
+
+    def enable_profiling(self, bins=64):
+        """
+        Starts timing each process callback with ``time.perf_counter_ns`` in
+        a preallocated `CallbackProfile` histogram. See `stats`.
+        """
+        self.profile = CallbackProfile(self.client.samplerate, bins)
+
+    def disable_profiling(self):
+        self.profile = None
+
+    def stats(self):
+        """
+        Returns a dict with the Jack CPU load, the number of xruns and, if
+        profiling is enabled, the timings of the process callback (see
+        ``CallbackProfile.stats``)
+        """
+        out = {'cpu_load': self.client.cpu_load(), 'xruns': len(self.xruns)}
+        if self.profile is not None:
+            out.update(self.profile.stats())
+        return out
+
+    def start_stats_logger(self, interval=5):
+        """
+        Prints a summary of `stats` every `interval` seconds from a separate
+        thread, until `stop_stats_logger` or `close` is called
+        """
+        self.stop_stats_logger()
+        self._logger_stop = stop = threading.Event()
+
+        def log():
+            while not stop.wait(interval):
+                s = self.stats()
+                line = f"{self.client.name}: cpu load {s['cpu_load']:.1f}%, "\
+                    f"{s['xruns']} xruns"
+                if 'worst_us' in s:
+                    line += f", callback mean {s['mean_us']:.1f} us, "\
+                        f"worst {s['worst_us']:.1f} us / " \
+                        f"{s['budget_us']:.1f} us, {s['overruns']} overruns"
+                print(line)
+
+        threading.Thread(target=log, daemon=True).start()
+
+    def stop_stats_logger(self):
+        if self._logger_stop is not None:
+            self._logger_stop.set()
+            self._logger_stop = None
+
     def is_ready(self):
         """
         Check if the client is active,  if it is in condition of processing
+        for the current job (it is not ready anymore once the job ended)
         and, if the current cycle is successive to the one in which the client
         became in condition of processing.
 
@@ -32,9 +274,36 @@ class JackClient:
         that this function starts returning `True` in the same cycle --
         otherwise, clients that were processed before of this could see this
         client not ready, while clients processed after this see it as ready.
+
+        If an xrun happened after the client became in condition of processing
+        but before it started (see `start_processing`), some client could
+        have skipped that cycle, so the client is not ready anymore and the
+        handshake is repeated.
+        """
+        if self.ready_at <= 0 or self.ready_at >= self.client.last_frame_time:
+            return False
+        if self.started_at < 0 and len(self.xruns) > 0:
+            return self.xruns[-1] < self.ready_at
+        return True
+
+    def start_processing(self):
+        """
+        To be called in the process callback at each cycle in which the
+        client actually processes data; it records the frame at which the
+        processing started in `self.started_at`.
         """
-        return self.ready_at < self.client.last_frame_time\
-            and self.ready_at > 0
+        if self.started_at < 0:
+            self.started_at = self.client.last_frame_time
+
+    def render_xruns(self):
+        """
+        Returns the number of xruns happened since the processing started; if
+        it is > 0, the output may contain gaps or be misaligned with the other
+        clients.
+        """
+        if self.started_at < 0:
+            return 0
+        return sum(1 for x in self.xruns if x >= self.started_at)
 
     def __enter__(self):
         return self
@@ -44,6 +313,12 @@ class JackClient:
         if isinstance(exc_type, Exception):
             print(exc_tb)
 
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
+
     def deactivate(self):
         """
         Deactivates the client and unregisters all input ports
@@ -61,6 +336,7 @@ class JackClient:
         """
         Deactivate, close and clear memory from this client
         """
+        self.stop_stats_logger()
         self.deactivate()
         self.client.close()
         self.clear()
@@ -78,8 +354,26 @@ class JackClient:
         pass
 
     def activate(self):
+        """
+        Activates the client, connects it to Carla with `_connect` and
+        prepares the next job with `_prepare`.
+
+        In persistent mode, `_connect` is called only the first time and
+        after that Carla disconnected.
+        """
+        if not (self.persistent and self.is_active and not self._stale):
+            self.deactivate()
+            self._connect()
+            self._stale = False
+        self._prepare()
+        self.is_active = True
+
+    def _connect(self):
         raise NotImplementedError("Abstract method")
 
+    def _prepare(self):
+        pass
+
     def wait(self, timeout=None, in_fw=False, out_fw=False):
         """
         Waits while setting freewheeling mode to `in_fw`
@@ -93,8 +387,53 @@ class JackClient:
         if not self.end_wait.is_set():
             self.set_freewheel(in_fw)
             success = self.end_wait.wait(timeout)
+        return self._finish(success, out_fw)
+
+    async def await_done(self, timeout=None, in_fw=False, out_fw=False):
+        """
+        Same as `wait`, but awaitable: the end of the processing is notified
+        to the event loop by the Jack thread, so that one loop can drive many
+        clients without blocking a thread for each of them.
+
+        Example
+        -------
+
+        .. code-block:: python
+
+            async with MIDIPlayer(name) as player:
+                async with AudioRecorder(name) as recorder:
+                    recorder.start(duration, condition=player.is_ready)
+                    player.synthesize_messages(messages,
+                                               condition=recorder.is_ready)
+                    await player.await_done(in_fw=True, out_fw=True)
+                    await recorder.await_done()
+        """
+        success = True
+        if not self.end_wait.is_set():
+            self.set_freewheel(in_fw)
+            success = await self.end_wait.wait_async(timeout)
+        return self._finish(success, out_fw)
+
+    def _finish(self, success, out_fw):
+        """
+        Called by `wait` and `await_done` once the processing ended; it sets
+        freewheeling mode to `out_fw` and deactivates the client (in
+        persistent mode, it makes the client idle). Subclasses can override it
+        to collect their output.
+
+        The client stops being ready, so that other clients waiting for it
+        (e.g. with ``condition=player.is_ready``) don't start the next job
+        before of it; `started_at` and `end_wait` are kept until the next job
+        starts, since they describe the job that just ended.
+        """
         self.set_freewheel(out_fw)
-        self.deactivate()
+        if self.persistent and self.is_active:
+            self.set_process_callback(self._idle)
+            self._sync()
+        else:
+            self.deactivate()
+        # only now that the callback of the job can't run anymore
+        self.ready_at = -1
         return success and not self.error
 
 
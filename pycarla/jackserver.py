@@ -1,3 +1,4 @@
+import asyncio
 import shutil
 import time
 
@@ -8,7 +9,7 @@ from .utils import Popen, find_procs_by_name, kill_psutil_process
 
 
 class JackServer(ExternalProcess):
-    def __init__(self, options):
+    def __init__(self, options, name=None):
         """
         Starts a jack server with given options and create a dummy client named
         `pycarla` to query and interact with it
@@ -17,9 +18,16 @@ class JackServer(ExternalProcess):
         ----
         `options` : list[str]
             list of options to be passed to Popen
+        `name` : str or None
+            the name of the server (``jackd -n``); use it to run more servers
+            at the same time. Clients connect to it if they are created with
+            the same `servername` or if the environment variable
+            ``JACK_DEFAULT_SERVER`` is set to it. If None, the default server
+            is used.
         """
-        super().__init__(options)
+        super().__init__(options, name)
         self.options = options
+        self.name = name
         if not shutil.which('jackd'):
             raise Warning(
                 "Jack seems not to be installed. Install it and put the \
@@ -27,17 +35,89 @@ class JackServer(ExternalProcess):
 
     def start(self):
         """
-        Starts the server if not already started
+        Starts the server if not already started and waits until it accepts
+        clients
+        """
+        if self._launch():
+            self.wait_ready()
+
+    async def astart(self, timeout=10, interval=0.01):
+        """
+        Same as `start`, but awaitable: the event loop is not blocked while
+        waiting for the server (see `await_ready`)
+        """
+        if self._launch():
+            await self.await_ready(timeout, interval)
+
+    def _launch(self):
+        """
+        Starts the server process if it is not running; returns True if it
+        was started
         """
         try:
-            self.process = find_procs_by_name('jackd')[0]
+            self.process = self.find_processes()[0]
         except (IndexError, jack.JackOpenError) as e:
             print("Jack server is not running, starting it!")
             if not self.process.is_running():
-                self.process = Popen(['jackd'] + self.options)
+                if self.name is None:
+                    self.process = Popen(['jackd'] + self.options)
+                else:
+                    self.process = Popen(['jackd', '-n', self.name] +
+                                         self.options)
             else:
                 raise e
-            time.sleep(1)
+            return True
+        return False
+
+    def is_up(self):
+        """
+        Returns True if the server accepts clients, i.e. its socket is up
+        """
+        try:
+            client = jack.Client("pycarla-probe",
+                                 no_start_server=True,
+                                 servername=self.name)
+        except jack.JackOpenError:
+            return False
+        client.close()
+        return True
+
+    def wait_ready(self, timeout=10, interval=0.01):
+        """
+        Waits until the server accepts clients, checking every `interval`
+        seconds. Raises `RuntimeError` if the server process dies or if
+        `timeout` seconds pass.
+        """
+        start = time.time()
+        while not self._check_ready(start, timeout):
+            time.sleep(interval)
+
+    async def await_ready(self, timeout=10, interval=0.01):
+        """
+        Same as `wait_ready`, but awaitable
+        """
+        start = time.time()
+        while not self._check_ready(start, timeout):
+            await asyncio.sleep(interval)
+
+    def _check_ready(self, start, timeout):
+        if self.is_up():
+            return True
+        if not self.process.is_running():
+            raise RuntimeError("The Jack server exited while starting")
+        if time.time() - start >= timeout:
+            raise RuntimeError("The Jack server is not ready after " +
+                               str(timeout) + " seconds")
+        return False
+
+    def find_processes(self):
+        """
+        Returns the list of running `jackd` processes serving this server name
+        """
+        procs = find_procs_by_name('jackd')
+        return [
+            p for p in procs if server_name(p.info['cmdline']) == self.name
+        ]
 
     def restart(self):
         """
@@ -50,3 +130,21 @@ class JackServer(ExternalProcess):
     def kill(self):
         kill_psutil_process(self.process)
         super().kill()
+
+
+def server_name(cmdline):
+    """
+    Returns the server name in a `jackd` command line (a list of strings) or
+    None if the default name is used
+    """
+    if not cmdline:
+        return None
+    for i, arg in enumerate(cmdline[:-1]):
+        if arg in ['-n', '--name']:
+            if cmdline[i + 1] == 'default':
+                return None
+            return cmdline[i + 1]
+        if arg.startswith('-d'):
+            # driver options start here
+            break
+    return None
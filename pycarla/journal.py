@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def written(path):
+    """
+    True if a non-empty file exists at `path`
+    """
+    return os.path.isfile(path) and os.path.getsize(path) > 0
+
+
+def checksum(path):
+    """
+    The sha256 of the content of the file at `path`
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(2**16), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Journal:
+    def __init__(self, path, verify=False):
+        """
+        An append-only JSONL journal of the renders of a batch, so that a
+        batch interrupted by a crash can be resumed without rendering again
+        the files already done.
+
+        Each line is the summary of one attempt (see
+        ``pycarla.batch.synthesize_many``) with the keys `status`
+        (``'done'``, ``'retry'`` or ``'failed'``), `time` and, for done
+        renders, the `sha256` of the output. Lines are flushed to disk one by
+        one; a line truncated by a crash is ignored when loading.
+
+        Renders are identified by their output path: one is considered done
+        if there is a ``'done'`` line for it and the output still exists; if
+        `verify` is True, the checksum of the output must match too.
+        """
+        self.path = path
+        self.verify = verify
+        # the last 'done' record of each output
+        self.done = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('status') == 'done':
+                        self.done[self._key(record['audio'])] = record
+
+    @staticmethod
+    def _key(audio):
+        return os.path.abspath(str(audio))
+
+    def is_done(self, audio):
+        """
+        True if the output `audio` was rendered and is still valid
+        """
+        record = self.done.get(self._key(audio))
+        if record is None or not os.path.exists(record['audio']):
+            return False
+        if self.verify:
+            return checksum(record['audio']) == record.get('sha256')
+        return True
+
+    def pending(self, jobs):
+        """
+        The `(midi, audio)` pairs in `jobs` whose output is not done
+        """
+        jobs = list(jobs)
+        pending = [job for job in jobs if not self.is_done(job[1])]
+        skipped = len(jobs) - len(pending)
+        if skipped > 0:
+            print(f"Skipping {skipped} files already rendered")
+        return pending
+
+    def append(self, item, status):
+        """
+        Appends the summary `item` of one render with `status`, adding the
+        checksum of the output of done renders; if the output can't be read,
+        the render is recorded as failed
+        """
+        record = dict(item, status=status, time=time.time())
+        record['midi'] = str(item['midi'])
+        record['audio'] = str(item['audio'])
+        if status == 'done':
+            try:
+                record['sha256'] = checksum(record['audio'])
+            except OSError as e:
+                print(f"Cannot read {record['audio']}: {e!r}")
+                record['status'] = status = 'failed'
+                record['success'] = False
+                record['error'] = repr(e)
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            if status == 'done':
+                self.done[self._key(record['audio'])] = record
+        return record
+
+
+def attempts(render, midi, audio, retries=0, backoff=1):
+    """
+    A generator of `(summary, status)` for each attempt of rendering `midi`
+    to `audio` with ``render(midi, audio)``, which must return a summary
+    dict (see ``pycarla.batch.synthesize_many``); exceptions are stored in
+    the `error` key of a failed summary. A render that reports success
+    without writing `audio` (see `written`) is failed too.
+
+    A failed render is tried again up to `retries` times, waiting
+    ``backoff * 2**(i - 1)`` seconds before of the `i`-th retry. `status`
+    is as in `Journal.append`.
+    """
+    for i in range(retries + 1):
+        if i > 0:
+            time.sleep(backoff * 2**(i - 1))
+        try:
+            item = render(midi, audio)
+        except Exception as e:
+            print(f"Error while rendering {midi}: {e!r}")
+            item = {'midi': midi, 'audio': audio, 'success': False}
+            item['error'] = repr(e)
+        if item['success'] and not written(audio):
+            print(f"No audio written to {audio}")
+            item['success'] = False
+            item['error'] = 'no audio written'
+        item['retries'] = i
+        if item['success']:
+            yield item, 'done'
+            return
+        yield item, 'retry' if i < retries else 'failed'
+
+
+def journaled(render, jobs, journal=None, retries=0, backoff=1):
+    """
+    Renders each `(midi, audio)` pair in `jobs` whose output is not done in
+    `journal` (a `Journal` or None) with ``render(midi, audio)``, retrying
+    failures (see `attempts`), and returns the list of the summaries of the
+    last attempts.
+    """
+    if journal is not None:
+        jobs = journal.pending(jobs)
+    summary = []
+    for midi, audio in jobs:
+        for item, status in attempts(render, midi, audio, retries, backoff):
+            if journal is not None:
+                journal.append(item, status)
+        summary.append(item)
+    return summary
@@ -1,27 +1,64 @@
 import multiprocessing
+import time
 from typing import Any, List
 
 import mido
+import numpy as np
 
+from .buffers import EventRing
+from .cache import get_schedule
 from .generics import JackClient
+from .schedule import EventSchedule, split_midifile
 
 
 class MIDIPlayer(JackClient):
 
     MIDI_PORT = 'Carla'
 
-    def __init__(self):
+    def __init__(self,
+                 servername=None,
+                 profile=False,
+                 persistent=False,
+                 port_map=None):
         """
         Creates a player which is able to connect to a Carla instance
 
         Optionally, `freewheel` can be used to start freeewheel mode before of
         playing.
 
-        For now, only one Carla instance should be active.
+        For now, only one Carla instance should be active in each Jack
+        server; `servername` selects the server (see `Carla`).
+
+        If `profile` is True, process callbacks are timed (see
+        ``JackClient.stats``). If `persistent` is True, the port stays
+        connected between jobs (see ``JackClient``).
+
+        By default, all messages are sent to the only MIDI input port
+        matching `MIDI_PORT`. To drive more plugins at once (e.g. in a Carla
+        patchbay), `port_map` maps MIDI channels (0 to 15) or track names to
+        the name patterns of Jack MIDI input ports, each matching exactly one
+        port; messages are then sent to the port of their channel or track.
+        The key None maps the messages not mapped otherwise, which are
+        dropped if it is missing. When routing by channel, system messages
+        (e.g. sysex) are sent to every port. In streaming mode, messages are
+        sent to the first port only.
         """
-        super().__init__("MIDIPlayer")
+        super().__init__("MIDIPlayer", servername, profile, persistent)
+        if port_map is not None:
+            keys = [k for k in port_map if k is not None]
+            if not (all(isinstance(k, int) for k in keys)
+                    or all(isinstance(k, str) for k in keys)):
+                raise ValueError(
+                    "`port_map` keys must be all channels or all track names")
+        self.port_map = port_map
+        self.ports = []
+        self._messages = []
+        self._ring = None
+        self._ending = False
+        self.latencies = np.zeros(0)
+        self._latency_count = 0
 
-    def activate(self):
+    def _connect(self):
         """
         Activate the MIDI player client and set the connections.
 
@@ -29,18 +66,76 @@ class MIDIPlayer(JackClient):
         `RuntimeWarning`. To avoid it, use ``Carla.exists`` method. Note that
         ``Carla.start`` already does that!
         """
-        carla_ports = self.client.get_ports(self.MIDI_PORT,
-                                            is_midi=True,
-                                            is_input=True)
-        if len(carla_ports) != 1:
-            raise RuntimeWarning(
-                "Cannot find the Carla instance, Retry later!")
+        targets = []
+        for pattern in self._patterns():
+            carla_ports = self.client.get_ports(pattern,
+                                                is_midi=True,
+                                                is_input=True)
+            if len(carla_ports) != 1:
+                raise RuntimeWarning(
+                    "Cannot find the Carla instance, Retry later!")
+            targets.append(carla_ports[0])
         self.client.activate()
         self.client.midi_outports.clear()
-        self.port = self.client.midi_outports.register('out')
-        if not self.port.is_connected_to(carla_ports[0]):
-            self.client.connect(self.port, carla_ports[0])
-        self.is_active = True
+        self.ports = []
+        for i, target in enumerate(targets):
+            port = self.client.midi_outports.register(
+                'out' if i == 0 else f'out{i}')
+            if not port.is_connected_to(target):
+                self.client.connect(port, target)
+            self.ports.append(port)
+        self.port = self.ports[0]
+
+    def _idle(self, frames):
+        if self.is_active:
+            for port in self.ports:
+                port.clear_buffer()
+
+    def _patterns(self):
+        """
+        The port name patterns of `port_map`, without duplicates
+        """
+        if self.port_map is None:
+            return [self.MIDI_PORT]
+        return list(dict.fromkeys(self.port_map.values()))
+
+    def _route(self, schedule, names=None, schedules=None):
+        """
+        Splits `schedule` in one `EventSchedule` per port, following
+        `port_map`; if `port_map` maps track names, the `schedules` of the
+        tracks and their `names` must be given instead (see
+        `pycarla.schedule.split_midifile`).
+        """
+        if self.port_map is None:
+            return [schedule]
+        patterns = self._patterns()
+        default = self.port_map.get(None)
+        if names is not None:
+            routes = []
+            for pattern in patterns:
+                selected = [
+                    s for name, s in zip(names, schedules)
+                    if self.port_map.get(name, default) == pattern
+                ]
+                if len(selected) == 0:
+                    routes.append(EventSchedule.from_events([], [], 0.0))
+                else:
+                    routes.append(EventSchedule.merge(selected))
+            return routes
+        if any(isinstance(k, str) for k in self.port_map):
+            raise ValueError("Routing by track name needs a MIDI file")
+        statuses = schedule.statuses()
+        system = statuses >= 0xF0
+        channels = statuses & 0x0F
+        mapped = [k for k in self.port_map if k is not None]
+        routes = []
+        for pattern in patterns:
+            keys = [k for k in mapped if self.port_map[k] == pattern]
+            mask = np.isin(channels, keys)
+            if default == pattern:
+                mask |= ~np.isin(channels, mapped)
+            routes.append(schedule.select(system | (~system & mask)))
+        return routes
 
     def clear(self):
         """
@@ -60,6 +155,10 @@ class MIDIPlayer(JackClient):
         1. Connect the port of this jack client to Carla if not yet done
         2. Send the list of messages to the Carla instance
 
+        `messages` can also be an already compiled `EventSchedule`; lists of
+        messages are compiled before of starting, so that the process
+        callback only writes precomputed bytes at precomputed frames.
+
         If `sync` is True, this function waits until all messages have been
         processed, otherwise, it suddenly returns. You can wait by calling the
         `wait` method of this object.
@@ -72,7 +171,11 @@ class MIDIPlayer(JackClient):
 
         `condition` is a function checked in the playing callback. If
         `condition()` is False, no message is sent. The callback start playing
-        at the cycle after the one in which `condition()` becomes True.
+        at the cycle after the one in which `condition()` becomes True; after
+        that, `condition` is not checked anymore (e.g. the recorder may end
+        its job first).
+
+        Messages are sent to the ports of `port_map`, routed by channel.
 
         `kwargs` are passed to `wait` if `sync` is True.
 
@@ -81,44 +184,165 @@ class MIDIPlayer(JackClient):
         when communicating with the user.
         """
         self._messages = messages
+        if isinstance(messages, EventSchedule):
+            schedule = messages
+        else:
+            schedule = EventSchedule.from_messages(messages)
 
-        global msg, offset
-        it = iter(self._messages)
-        msg = next(it)
-        offset = 0
-        self.ready_at = -1
+        return self._play(self._route(schedule), sync, condition, **kwargs)
+
+    def _play(self, schedules, sync=False, condition=lambda: True, **kwargs):
+        """
+        Plays one `EventSchedule` per port of `self.ports`; see
+        `synthesize_messages`
+        """
+        # frames, bytes, offsets and number of events for each port
+        routes = [(s.frames(self.client.samplerate), memoryview(s.data),
+                   s.offsets.tolist(), len(s)) for s in schedules]
+        # index of the next event of each port and number of frames already
+        # played
+        self._next_events = [0] * len(routes)
+        self._played_frames = 0
+        self._new_job()
 
-        @self.client.set_process_callback
         def process(frames):
             if self.is_active:
-                global offset, msg
-                for port in self.client.midi_outports:
-                    if not self.is_ready():
-                        print(self.client.name + " ready!")
-                        # let other clients know that this is ready
-                        self.ready_at = self.client.last_frame_time
-                    elif condition():
-                        # start only if other clients are ready too
-                        port.clear_buffer()
-                        while True:
-
-                            if offset >= frames:
-                                # wait for the correct block
-                                offset -= frames
-                                return
+                for port in self.ports:
+                    port.clear_buffer()
+                if not self.is_ready():
+                    print(self.client.name + " ready!")
+                    # let other clients know that this is ready
+                    self.ready_at = self.client.last_frame_time
+                elif self.started_at >= 0 or condition():
+                    # start only if other clients are ready too
+                    self.start_processing()
+                    played = self._played_frames
+                    done = True
+                    for k, route in enumerate(routes):
+                        event_frames, data, offsets, n_events = route
+                        port = self.ports[k]
+                        first = self._next_events[k]
+                        last = event_frames.searchsorted(played + frames)
+                        for i in range(first, last):
                             # Note: This may raise an exception:
-                            port.write_midi_event(offset, msg.bytes())
-
-                            try:
-                                msg = next(it)
-                            except StopIteration:
-                                self.end_wait.set()
-                            offset += round(msg.time * self.client.samplerate)
+                            port.write_midi_event(
+                                int(event_frames[i]) - played,
+                                data[offsets[i]:offsets[i + 1]])
+                        self._next_events[k] = last
+                        done = done and last >= n_events
+                    self._played_frames = played + frames
+                    if done:
+                        self.end_wait.set()
 
         self.activate()
+        self.set_process_callback(process)
         if sync:
             self.wait(**kwargs)
 
+    def stream(self, capacity=1024, max_bytes=16, history=4096):
+        """
+        Starts the streaming mode: messages passed to `push` while Carla is
+        playing are sent in the next Jack period, at the offset corresponding
+        to the time of the `push` call, so that the timing among messages is
+        kept with sample accuracy and all of them are delayed by one period.
+
+        Messages are queued in a preallocated `EventRing` of `capacity` events
+        of at most `max_bytes` bytes each; `push` can be called from any
+        thread.
+
+        For each message, the delay between the `push` call and the time at
+        which its frame is played back (in the period after the one in which
+        it is written to Jack) is stored in nanoseconds in `latencies`, which
+        keeps the last `history` values; see `stream_stats`. It doesn't
+        include the latency of Carla and of the sound card.
+
+        Call `end_stream` and then `wait` (or `await_done`) to stop
+        streaming.
+        """
+        ring = self._ring = EventRing(capacity, max_bytes)
+        # messages are not kept in streaming mode
+        self._messages = []
+        self._ending = False
+        self.latencies = latencies = np.zeros(history)
+        self._latency_count = 0
+        self._new_job()
+        ns_per_frame = 1e9 / self.client.samplerate
+
+        def process(frames):
+            if not self.is_active:
+                return
+            self.port.clear_buffer()
+            self.start_processing()
+            now = time.perf_counter_ns()
+            # frames elapsed since the start of this period
+            elapsed = self.client.frames_since_cycle_start
+            # events pushed during the previous period are played in this one
+            start = self.client.last_frame_time - frames
+            offset = 0
+            for k in range(ring.available):
+                i = ring.read % ring.capacity
+                # Jack needs non-decreasing offsets inside the period
+                offset = min(max(offset, int(ring.frames[i]) - start),
+                             frames - 1)
+                # Note: This may raise an exception:
+                self.port.write_midi_event(offset,
+                                           ring.rows[i][:ring.sizes[i]])
+                latencies[self._latency_count % history] = \
+                    now - ring.times[i] + \
+                    (frames + offset - elapsed) * ns_per_frame
+                self._latency_count += 1
+                ring.read += 1
+            if self._ending and ring.available == 0:
+                self.end_wait.set()
+
+        self.activate()
+        self.set_process_callback(process)
+
+    def push(self, message):
+        """
+        Queues a `mido.Message` (or its raw bytes) to be sent in streaming
+        mode (see `stream`). It can be called from any thread.
+
+        Returns False if the queue is full and the message was dropped.
+        """
+        if self._ring is None:
+            raise RuntimeError("Call `stream` before of pushing messages")
+        if isinstance(message, mido.Message):
+            data = message.bin()
+        else:
+            data = bytes(message)
+        return self._ring.push(data, self.client.frame_time,
+                               time.perf_counter_ns())
+
+    def end_stream(self):
+        """
+        Stops accepting messages in streaming mode; `end_wait` is set once the
+        queued messages have been sent.
+        """
+        self._ending = True
+
+    def stream_stats(self):
+        """
+        Returns a dict with the number of messages sent in streaming mode, the
+        number of messages dropped because the queue was full and the mean,
+        median, 99th percentile and maximum latency in milliseconds (see
+        `stream`) computed over the last `history` messages
+        """
+        n = min(self._latency_count, len(self.latencies))
+        out = {
+            'events': self._latency_count,
+            'overflows': self._ring.overflows if self._ring else 0
+        }
+        if n > 0:
+            latencies = self.latencies[:n] / 1e6
+            out.update({
+                'latency_mean_ms': float(np.mean(latencies)),
+                'latency_p50_ms': float(np.percentile(latencies, 50)),
+                'latency_p99_ms': float(np.percentile(latencies, 99)),
+                'latency_max_ms': float(np.max(latencies))
+            })
+        return out
+
     def synthesize_midi_note(self,
                              pitch: int,
                              velocity: int,
@@ -173,21 +397,30 @@ class MIDIPlayer(JackClient):
 
         return self.synthesize_messages(messages, **kwargs)
 
-    def synthesize_midi_file(self, midifile: Any,
+    def synthesize_midi_file(self,
+                             midifile: Any,
+                             cache=True,
                              **kwargs) -> multiprocessing.Process:
         """
         Send midi messages contained in `filename` using
         `self.synthesize_messages`. All keywords from that method can be used
         here.
 
-        `midifile` can be a `mido.MidiFile` object or a string
+        `midifile` can be a `mido.MidiFile` object or a string; message times
+        are computed from ticks and from the tempo map (see `pycarla.timing`).
+        Compiled paths are stored in `cache` (see
+        `pycarla.cache.get_schedule`), so they are parsed only once.
+
+        If `port_map` maps track names, tracks are compiled separately and
+        the cache is not used.
 
         After the playback, ports are resetted
         """
-
-        if type(midifile) is str:
-            midifile = mido.MidiFile(midifile)
-
-        messages = [m for m in midifile]
-
-        return self.synthesize_messages(messages, **kwargs)
+        if self.port_map is not None and any(
+                isinstance(k, str) for k in self.port_map):
+            names, schedules = split_midifile(midifile, 'track')
+            # the schedules of the tracks, in place of the messages
+            self._messages = schedules
+            return self._play(self._route(None, names, schedules), **kwargs)
+        return self.synthesize_messages(get_schedule(midifile, cache),
+                                        **kwargs)
@@ -0,0 +1,308 @@
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import threading
+from multiprocessing.util import Finalize
+
+from .audiorecorder import AudioRecorder
+from .batch import output_jobs, render_file
+from .carla import Carla
+from .journal import Journal, attempts
+from .midiplayer import MIDIPlayer
+
+# the session of the current worker process
+_session = None
+
+
+class RenderSession:
+    def __init__(self, proj_path, server_options, server_name, min_wait=0):
+        """
+        One Jack server, one Carla instance and one pair of persistent
+        clients (see ``JackClient``), all living in a worker process of a
+        `RenderPool`.
+
+        ``JACK_DEFAULT_SERVER`` is set to `server_name` for the whole worker
+        process, so that any other client created there connects to this
+        server too.
+        """
+        os.environ['JACK_DEFAULT_SERVER'] = server_name
+        self.server_name = server_name
+        self.carla = Carla(proj_path,
+                           server_options,
+                           min_wait=min_wait,
+                           server_name=server_name)
+        self.carla.start()
+        self.player = MIDIPlayer(server_name, persistent=True)
+        self.recorder = AudioRecorder(server_name, persistent=True)
+        self.recorder.set_freewheel(True)
+
+    def close(self):
+        """
+        Closes the clients and kills Carla and its Jack server
+        """
+        try:
+            self.recorder.set_freewheel(False)
+            self.player.close()
+            self.recorder.close()
+        finally:
+            self.carla.kill()
+
+
+def _init_worker(names, proj_path, server_options, min_wait):
+    global _session
+    _session = RenderSession(proj_path, server_options, names.get(),
+                             min_wait)
+    Finalize(None, _session.close, exitpriority=10)
+
+
+def _run_job(func, job):
+    return func(_session, job)
+
+
+def _render_job(session, job):
+    midi, audio, args, retries, backoff = job
+
+    def render_one(midi, audio):
+        session.carla.wait_exists(session.carla.READY_TIMEOUT)
+        return render_file(session.player, session.recorder, midi, audio,
+                           *args)
+
+    return list(attempts(render_one, midi, audio, retries, backoff))
+
+
+def _last_attempts(results, journal):
+    for job_attempts in results:
+        for item, status in job_attempts:
+            if journal is not None:
+                journal.append(item, status)
+        yield item
+
+
+class RenderPool:
+    def __init__(self,
+                 proj_path,
+                 processes=None,
+                 server_options=['-d', 'dummy'],
+                 min_wait=0,
+                 prefix='pycarla'):
+        """
+        A pool of `processes` worker processes (default: number of CPUs), each
+        one running its own Jack server, named `prefix` followed by the index
+        of the worker, with its own Carla instance loading `proj_path`.
+
+        `server_options` are the options of each `jackd`; the default uses the
+        dummy backend, so that no sound card is needed and every server can
+        run freewheeling independently from the others.
+
+        Workers are never replaced: if one of them dies (e.g. because Jack or
+        Carla can't be started, or because it crashes during a job), the pool
+        is broken and the results of the pending jobs raise
+        ``concurrent.futures.process.BrokenProcessPool``.
+
+        Use it as a context manager or call `close` at the end, so that all
+        the servers are killed.
+        """
+        if processes is None:
+            processes = os.cpu_count()
+        # each name is taken by one worker, since workers are never replaced
+        names = multiprocessing.Queue()
+        for i in range(processes):
+            names.put(prefix + str(i))
+        self.processes = processes
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            processes,
+            initializer=_init_worker,
+            initargs=(names, proj_path, server_options, min_wait))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def imap(self, func, jobs):
+        """
+        Runs ``func(session, job)`` for each job in `jobs` in the worker
+        processes, where `session` is the `RenderSession` of the worker.
+        `func` must be a module-level function (it is pickled).
+
+        Returns an iterator over the results, in the order in which they
+        finish; it raises the exceptions of the jobs, or
+        ``BrokenProcessPool`` if a worker died.
+        """
+        futures = [self.pool.submit(_run_job, func, job) for job in jobs]
+        return (f.result() for f in concurrent.futures.as_completed(futures))
+
+    def synthesize_many(self,
+                        midi_paths,
+                        out_dir,
+                        decay=4,
+                        ext='.wav',
+                        stream=False,
+                        on_xrun='rerender',
+                        max_attempts=3,
+                        silence_threshold=None,
+                        compensate_latency=False,
+                        journal=None,
+                        retries=0,
+                        backoff=1):
+        """
+        Same as `pycarla.batch.synthesize_many`, but files are distributed
+        over the servers of the pool. Retries happen in the worker processes,
+        while the `journal` is only written by this process.
+
+        Returns an iterator over the summaries of each file, in the order in
+        which they finish.
+        """
+        jobs = output_jobs(midi_paths, out_dir, ext)
+        os.makedirs(out_dir, exist_ok=True)
+        if isinstance(journal, (str, os.PathLike)):
+            journal = Journal(journal)
+        if journal is not None:
+            jobs = journal.pending(jobs)
+        args = (decay, stream, on_xrun, max_attempts, silence_threshold,
+                compensate_latency)
+        results = self.imap(_render_job,
+                            ((midi, audio, args, retries, backoff)
+                             for midi, audio in jobs))
+        return _last_attempts(results, journal)
+
+    def close(self):
+        """
+        Waits for the pending jobs, then closes the workers and kills their
+        Jack servers and Carla instances
+        """
+        self.pool.shutdown(wait=True)
+
+
+class CarlaPool:
+    def __init__(self,
+                 server_options=['-d', 'dummy'],
+                 max_memory=None,
+                 prefix='pycarla-warm',
+                 **kwargs):
+        """
+        A pool of already started Carla instances, keyed by the path of their
+        project, so that jobs alternating among a few presets pay the loading
+        cost only once.
+
+        Each instance runs in its own Jack server (named `prefix` followed by
+        a counter), so that clients can tell instances apart: create clients
+        with ``servername=carla.server_name``.
+
+        When the resident memory of all the instances exceeds `max_memory`
+        bytes, the least recently used idle instances are killed. `kwargs`
+        are passed to `Carla` (e.g. `min_wait` or `probe`).
+        """
+        self.server_options = server_options
+        self.max_memory = max_memory
+        self.prefix = prefix
+        self.kwargs = kwargs
+        # (project path, Carla) of idle instances, least recently used first
+        self._idle = []
+        self._leased = []
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @contextlib.contextmanager
+    def lease(self, proj_path):
+        """
+        A context manager that acquires a started `Carla` loading `proj_path`
+        and releases it at the end
+
+        Example
+        -------
+
+        .. code-block:: python
+
+            with pool.lease("piano.carxp") as carla:
+                pycarla.synthesize_many(carla, midi_paths, "out_dir")
+        """
+        carla = self.acquire(proj_path)
+        try:
+            yield carla
+        finally:
+            self.release(carla)
+
+    def acquire(self, proj_path):
+        """
+        Returns an idle instance loading `proj_path`, or starts a new one.
+        Call `release` when you're done with it.
+        """
+        key = os.path.abspath(proj_path)
+        carla = None
+        with self._lock:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if self._idle[i][0] == key:
+                    carla = self._idle.pop(i)[1]
+                    break
+        if carla is not None and not carla.exists():
+            print("Warm Carla instance is dead, starting a new one")
+            self._kill(carla)
+            carla = None
+        if carla is None:
+            with self._lock:
+                name = self.prefix + str(self._count)
+                self._count += 1
+            carla = Carla(key,
+                          self.server_options,
+                          server_name=name,
+                          **self.kwargs)
+            carla.start()
+        with self._lock:
+            self._leased.append(carla)
+        self.evict()
+        return carla
+
+    def release(self, carla):
+        """
+        Gives back an instance obtained with `acquire`
+        """
+        with self._lock:
+            self._leased.remove(carla)
+            self._idle.append((os.path.abspath(carla.proj_path), carla))
+        self.evict()
+
+    def memory_usage(self):
+        """
+        The resident memory in bytes of all the instances
+        """
+        with self._lock:
+            instances = [c for k, c in self._idle] + self._leased
+        return sum(c.memory_usage() for c in instances)
+
+    def evict(self):
+        """
+        Kills the least recently used idle instances until the memory usage is
+        below `max_memory`
+        """
+        if self.max_memory is None:
+            return
+        while self.memory_usage() > self.max_memory:
+            with self._lock:
+                if len(self._idle) == 0:
+                    return
+                key, carla = self._idle.pop(0)
+            print("Evicting Carla instance for " + key)
+            self._kill(carla)
+
+    @staticmethod
+    def _kill(carla):
+        try:
+            carla.kill()
+        except Exception:
+            print("Processes already closed!")
+
+    def close(self):
+        """
+        Kills all the idle instances; leased ones are killed when released
+        """
+        self.max_memory = -1
+        self.evict()
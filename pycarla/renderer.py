@@ -0,0 +1,162 @@
+import soundfile as sf
+
+from .buffers import ArrayBuffer
+from .generics import JackClient
+from .schedule import EventSchedule
+
+
+class Renderer(JackClient):
+    MIDI_PORT = 'Carla'
+    AUDIO_PORT = 'Carla'
+
+    def __init__(self, servername=None, profile=False, persistent=False):
+        """
+        A single client that sends MIDI messages to a Carla instance and
+        records its output in the same process callback, so that no
+        synchronization with other clients is needed.
+
+        Since this client is both upstream and downstream of Carla, Jack
+        processes it before of Carla and the audio it captures in each cycle
+        is the one produced by Carla in the previous cycle. The renderer
+        discards the first captured cycle, so that frame 0 of `recorded` is
+        the frame at which the first MIDI message was sent.
+
+        For now, only one Carla instance should be active in each Jack
+        server; `servername` selects the server (see `Carla`).
+
+        If `profile` is True, process callbacks are timed (see
+        ``JackClient.stats``). If `persistent` is True, ports stay connected
+        between renders (see ``JackClient``).
+        """
+        super().__init__("Renderer", servername, profile, persistent)
+        self.recorded = []
+        self._buffer = None
+        self._needed_samples = -1
+
+    def _connect(self):
+        """
+        Activate the client and connect one MIDI output port and one audio
+        input port per each Carla output port.
+
+        If the Carla instance is not found, this method rase a
+        `RuntimeWarning`. To avoid it, use ``Carla.exists`` method. Note that
+        ``Carla.start`` already does that!
+        """
+        midi_ports = self.client.get_ports(self.MIDI_PORT,
+                                           is_midi=True,
+                                           is_input=True)
+        audio_ports = self.client.get_ports(self.AUDIO_PORT,
+                                            is_audio=True,
+                                            is_output=True)
+        if len(midi_ports) != 1 or len(audio_ports) == 0:
+            raise RuntimeWarning(
+                "Cannot find the Carla instance, Retry later!")
+        self.channels = len(audio_ports)
+        self.client.activate()
+        self.client.midi_outports.clear()
+        self.client.inports.clear()
+        self.port = self.client.midi_outports.register('out')
+        if not self.port.is_connected_to(midi_ports[0]):
+            self.client.connect(self.port, midi_ports[0])
+        for i, p in enumerate(audio_ports):
+            inp = self.client.inports.register(f"in{i}")
+            if not inp.is_connected_to(p):
+                self.client.connect(p, inp)
+
+    def _prepare(self):
+        """
+        Allocate the recording buffer
+        """
+        frames = self._needed_samples + self.client.blocksize
+        self._buffer = ArrayBuffer(self.channels, frames)
+
+    def _idle(self, frames):
+        if self.is_active:
+            self.port.clear_buffer()
+
+    def clear(self):
+        """
+        Clears the `recorded` array
+        """
+        del self.recorded
+        self.recorded = []
+        self._buffer = None
+
+    def render(self, messages, duration=None, sync=False, **kwargs):
+        """
+        Send `messages` (a list of `mido` messages or an `EventSchedule`) to
+        Carla and record its output for `duration` seconds (default: the
+        duration of the messages).
+
+        If `sync` is True, this function waits until the end of the rendering,
+        otherwise it suddenly returns and you should call `wait`; `kwargs` are
+        passed to `wait` if `sync` is True.
+        """
+        if isinstance(messages, EventSchedule):
+            schedule = messages
+        else:
+            schedule = EventSchedule.from_messages(messages)
+        if duration is None:
+            duration = schedule.duration
+
+        samplerate = self.client.samplerate
+        self._needed_samples = max(1, int(duration * samplerate))
+        event_frames = schedule.frames(samplerate)
+        data = memoryview(schedule.data)
+        offsets = schedule.offsets.tolist()
+        n_events = len(schedule)
+        self._next_event = 0
+        self._played_frames = 0
+        self.recorded = []
+        self._new_job()
+
+        def process(frames):
+            if not self.is_active:
+                return
+            self.port.clear_buffer()
+            if not self.is_ready():
+                # wait one cycle so that connections are in place
+                self.ready_at = self.client.last_frame_time
+                return
+            self.start_processing()
+            played = self._played_frames
+            first = self._next_event
+            last = event_frames.searchsorted(played + frames)
+            for i in range(first, last):
+                # Note: This may raise an exception:
+                self.port.write_midi_event(int(event_frames[i]) - played,
+                                           data[offsets[i]:offsets[i + 1]])
+            self._next_event = last
+            if played > 0:
+                # audio produced by Carla in the previous cycle
+                self._buffer.write(
+                    (p.get_array() for p in self.client.inports), frames)
+            self._played_frames = played + frames
+            if last >= n_events and\
+                    self._buffer.length >= self._needed_samples:
+                self.end_wait.set()
+
+        self.activate()
+        self.set_process_callback(process)
+        if sync:
+            self.wait(**kwargs)
+
+    def _finish(self, success, out_fw):
+        """
+        Stores the recorded array, trimmed to the requested duration, in
+        `self.recorded` once the rendering is finished (see ``JackClient.wait``
+        and ``JackClient.await_done``)
+        """
+        out = super()._finish(success, out_fw)
+        if self._buffer is not None:
+            self.recorded = self._buffer.array[:, :self._needed_samples]
+        return out
+
+    def save_recorded(self, filename):
+        """
+        Save the recorded array to file. Extensions supported by
+        ``libsndfile``!
+        """
+        if len(self.recorded) == 0:
+            raise RuntimeError("No recorded array!")
+        sf.write(str(filename), self.recorded.T, int(self.client.samplerate))
@@ -0,0 +1,177 @@
+import mido
+import numpy as np
+
+from .timing import midifile_times, track_times
+
+
+class EventSchedule:
+    def __init__(self, times, data, offsets, duration=None):
+        """
+        A list of MIDI events compiled ahead of time, so that the process
+        callback doesn't need to create Python objects for each event.
+
+        * `times` is a float64 array with the absolute time in seconds of each
+          event
+        * `data` is a `bytes` object containing all the events one after the
+          other
+        * `offsets` is an int64 array with ``len(times) + 1`` elements: the
+          bytes of the `i`-th event are ``data[offsets[i]:offsets[i + 1]]``
+        * `duration` is the duration in seconds; if None, the time of the last
+          event is used
+
+        Use `from_messages` or `from_midifile` to build it.
+        """
+        self.times = times
+        self.data = data
+        self.offsets = offsets
+        if duration is None:
+            duration = times[-1] if len(times) > 0 else 0.0
+        self.duration = duration
+
+    @classmethod
+    def from_messages(cls, messages):
+        """
+        Compiles a list of `mido` messages whose `time` is the delta time in
+        seconds from the previous message, as the ones obtained by iterating
+        over a ``mido.MidiFile``.
+
+        Absolute times are computed with one cumulative sum in float64, so no
+        rounding error accumulates. Meta messages are not sent to Jack, but
+        their delta times are taken into account.
+        """
+        deltas = np.fromiter((m.time for m in messages),
+                             dtype=np.float64,
+                             count=len(messages))
+        return cls._from_times(np.cumsum(deltas), messages)
+
+    @classmethod
+    def from_midifile(cls, midifile):
+        """
+        Compiles a ``mido.MidiFile`` (or the path to a MIDI file), computing
+        the absolute times directly from ticks and from the tempo map (see
+        `pycarla.timing`)
+        """
+        if not isinstance(midifile, mido.MidiFile):
+            midifile = mido.MidiFile(str(midifile))
+        return cls._from_times(*midifile_times(midifile))
+
+    @classmethod
+    def _from_times(cls, times, messages, duration=None):
+        if duration is None:
+            duration = times[-1] if len(times) > 0 else 0.0
+        keep = [i for i, m in enumerate(messages) if not m.is_meta]
+        events = [bytes(messages[i].bytes()) for i in keep]
+        return cls.from_events(times[keep], events, duration)
+
+    @classmethod
+    def from_events(cls, times, events, duration=None):
+        """
+        Builds the schedule from an array of absolute `times` in seconds and a
+        list of `bytes`, one per event
+        """
+        lengths = np.fromiter(map(len, events),
+                              dtype=np.int64,
+                              count=len(events))
+        offsets = np.zeros(len(events) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.asarray(times, dtype=np.float64), b''.join(events),
+                   offsets, duration)
+
+    @classmethod
+    def merge(cls, schedules):
+        """
+        Merges more schedules in one, keeping the order of simultaneous events
+        and the longest duration
+        """
+        times = np.concatenate([s.times for s in schedules])
+        events = [
+            s.event(i).tobytes() for s in schedules for i in range(len(s))
+        ]
+        order = np.argsort(times, kind='stable')
+        return cls.from_events(times[order], [events[i] for i in order],
+                               max(s.duration for s in schedules))
+
+    def __len__(self):
+        return len(self.times)
+
+    def frames(self, samplerate):
+        """
+        Returns the int64 array of the absolute frame of each event at
+        `samplerate`, rounded once
+        """
+        return np.round(self.times * samplerate).astype(np.int64)
+
+    def select(self, indices):
+        """
+        Returns a new schedule with the events at `indices` (an array of
+        indices or a boolean mask), keeping the duration of this one
+        """
+        indices = np.arange(len(self))[indices]
+        data = memoryview(self.data)
+        events = [
+            data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+            for i in indices
+        ]
+        return EventSchedule.from_events(self.times[indices], events,
+                                         self.duration)
+
+    def statuses(self):
+        """
+        Returns the uint8 array of the status byte of each event
+        """
+        data = np.frombuffer(self.data, dtype=np.uint8)
+        return data[self.offsets[:-1]]
+
+    def event(self, i):
+        """
+        Returns a `memoryview` of the bytes of the `i`-th event
+        """
+        return memoryview(self.data)[self.offsets[i]:self.offsets[i + 1]]
+
+
+def split_midifile(midifile, by='track'):
+    """
+    Splits a ``mido.MidiFile`` (or the path to a MIDI file) in one
+    `EventSchedule` per stem.
+
+    If `by` is ``'track'``, there is one stem per track containing MIDI
+    events, named after the track (or ``track<index>`` if it has no name); if
+    `by` is ``'channel'``, there is one stem per MIDI channel used, named
+    ``channel<number>`` with channels numbered 1 to 16, and system messages
+    (e.g. sysex) are sent to every stem.
+
+    Times always follow the tempo map of the whole file and every stem keeps
+    the duration of the whole file, so that the stems are aligned.
+
+    Returns
+    -------
+    list[str] :
+        the names of the stems
+    list[EventSchedule] :
+        the schedules of the stems
+    """
+    if not isinstance(midifile, mido.MidiFile):
+        midifile = mido.MidiFile(str(midifile))
+    times, messages = midifile_times(midifile)
+    duration = times[-1] if len(times) > 0 else 0.0
+    names = []
+    schedules = []
+    if by == 'track':
+        for i, (times, messages) in enumerate(track_times(midifile)):
+            schedule = EventSchedule._from_times(times, messages, duration)
+            if len(schedule) == 0:
+                continue
+            names.append(midifile.tracks[i].name or f"track{i}")
+            schedules.append(schedule)
+    elif by == 'channel':
+        schedule = EventSchedule._from_times(times, messages)
+        statuses = schedule.statuses()
+        system = statuses >= 0xF0
+        channels = statuses & 0x0F
+        for c in np.unique(channels[~system]):
+            names.append(f"channel{c + 1}")
+            schedules.append(
+                schedule.select(system | (~system & (channels == c))))
+    else:
+        raise ValueError("`by` must be 'track' or 'channel'")
+    return names, schedules
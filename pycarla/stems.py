@@ -0,0 +1,91 @@
+import numpy as np
+
+from .audiorecorder import AudioRecorder
+from .midiplayer import MIDIPlayer
+from .pool import RenderPool
+from .schedule import split_midifile
+
+
+def split(midifile, by='track'):
+    """
+    Splits `midifile` in one `EventSchedule` per track or per channel; see
+    `pycarla.schedule.split_midifile`
+    """
+    return split_midifile(midifile, by)
+
+
+def render_schedule(player,
+                    recorder,
+                    schedule,
+                    decay=4,
+                    compensate_latency=True):
+    """
+    Renders `schedule` plus `decay` seconds in freewheeling mode with already
+    created `player` and `recorder`, and returns the recorded
+    `(channels, frames)` array. Freewheel is left on.
+    """
+    recorder.start(schedule.duration + decay,
+                   condition=player.is_ready,
+                   compensate_latency=compensate_latency)
+    player.synthesize_messages(schedule, condition=recorder.is_ready)
+    success = player.wait(in_fw=True, out_fw=True)
+    if not recorder.wait(in_fw=True, out_fw=True) or not success:
+        raise RuntimeError("Error while rendering a stem")
+    return recorder.trimmed()
+
+
+def _stem_job(session, job):
+    index, schedule, decay, compensate_latency = job
+    session.carla.wait_exists(session.carla.READY_TIMEOUT)
+    return index, render_schedule(session.player, session.recorder, schedule,
+                                  decay, compensate_latency)
+
+
+def render_stems(midifile,
+                 renderer,
+                 by='track',
+                 decay=4,
+                 compensate_latency=True):
+    """
+    Renders each stem of `midifile` (see `split`) separately and returns
+    their names and a float32 array of shape `(stems, channels, frames)`,
+    where shorter stems are padded with zeros.
+
+    `renderer` is either a `pycarla.pool.RenderPool`, in which case stems are
+    rendered in parallel on its servers and the total wall time is about the
+    one of a single render, or a started `Carla` instance, in which case
+    stems are rendered one after the other with the same pair of clients,
+    keeping freewheel on.
+
+    Stems are rendered separately because all the MIDI channels sent to a
+    Carla instance reach the same audio outputs: with the pool, each stem
+    gets its own Carla instance.
+    """
+    names, schedules = split(midifile, by)
+    jobs = [(i, schedule, decay, compensate_latency)
+            for i, schedule in enumerate(schedules)]
+    if isinstance(renderer, RenderPool):
+        results = list(renderer.imap(_stem_job, jobs))
+    else:
+        results = []
+        with MIDIPlayer(renderer.server_name, persistent=True) as player,\
+                AudioRecorder(renderer.server_name,
+                              persistent=True) as recorder:
+            recorder.set_freewheel(True)
+            try:
+                for i, schedule, decay, compensate_latency in jobs:
+                    renderer.wait_exists(renderer.READY_TIMEOUT)
+                    audio = render_schedule(player, recorder, schedule, decay,
+                                            compensate_latency)
+                    results.append((i, audio))
+            finally:
+                recorder.set_freewheel(False)
+
+    if len(results) == 0:
+        return names, np.zeros((0, 0, 0), dtype=np.float32)
+    channels = max(audio.shape[0] for i, audio in results)
+    frames = max(audio.shape[1] for i, audio in results)
+    stems = np.zeros((len(results), channels, frames), dtype=np.float32)
+    for i, audio in results:
+        stems[i, :audio.shape[0], :audio.shape[1]] = audio
+    return names, stems
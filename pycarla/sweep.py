@@ -0,0 +1,146 @@
+import itertools
+import os
+
+from .batch import synthesize_many
+from .carla import Carla
+from .jackserver import JackServer
+from .pool import RenderPool
+
+
+def config_options(config, driver='dummy'):
+    """
+    The `jackd` options of a server configuration: a dict with keys
+    `samplerate` and `period` and, optionally, `options`, a list of further
+    driver options (e.g. ``['-n', '3']``)
+    """
+    return ['-d', driver, '-r', str(config['samplerate']), '-p',
+            str(config['period'])] + list(config.get('options', []))
+
+
+def config_name(config):
+    """
+    A name for the configuration, used as output subdirectory, e.g.
+    ``48000Hz-256``
+    """
+    return f"{config['samplerate']}Hz-{config['period']}"
+
+
+def check_config(client, config):
+    """
+    Raises `RuntimeError` if the server of the ``jack.Client`` `client`
+    doesn't run with the sample rate and the period of `config`
+    """
+    actual = {'samplerate': client.samplerate, 'period': client.blocksize}
+    for key, value in actual.items():
+        if value != config[key]:
+            raise RuntimeError(f"The Jack server runs at {actual}, not at "
+                               f"{config_name(config)}")
+
+
+def check_free(server_names):
+    """
+    Raises `RuntimeError` if any Jack server in `server_names` (None is the
+    default server) is already running, since it would be reused with its
+    own configuration
+    """
+    for name in server_names:
+        if JackServer([], name).find_processes():
+            raise RuntimeError(
+                f"The Jack server {name or 'default'} is already running: "
+                "kill it, since its configuration can't be changed")
+
+
+def product(midi_paths, configs):
+    """
+    The jobs rendering each file in `midi_paths` with each configuration in
+    `configs`
+    """
+    return list(itertools.product(midi_paths, configs))
+
+
+def group_jobs(jobs):
+    """
+    Groups `jobs`, an iterable of `(midi_path, config)` pairs, by
+    configuration, keeping the order in which configurations first appear.
+
+    Returns
+    -------
+    list[tuple[dict, list[str]]] :
+        the configurations and the paths to render with each of them
+    """
+    groups = {}
+    for path, config in jobs:
+        key = (config['samplerate'], config['period'],
+               tuple(config.get('options', [])))
+        if key not in groups:
+            groups[key] = (config, [])
+        groups[key][1].append(path)
+    return list(groups.values())
+
+
+def sweep(proj_path,
+          jobs,
+          out_dir,
+          driver='dummy',
+          processes=None,
+          server_name=None,
+          min_wait=0,
+          probe=False,
+          **kwargs):
+    """
+    Renders `jobs`, an iterable of `(midi_path, config)` pairs (see `product`
+    and `config_options`), restarting the Jack server and Carla only when
+    the configuration changes: jobs are grouped by configuration and each
+    configuration is started once, runs all its jobs while warm and is
+    killed before of starting the next one.
+
+    If `processes` is None, files are rendered by one Carla instance with
+    `pycarla.batch.synthesize_many`; otherwise, each configuration is
+    rendered by a `pycarla.pool.RenderPool` of `processes` servers.
+
+    Servers are never reused: `RuntimeError` is raised if one of them is
+    already running, or if it doesn't run at the sample rate and period of
+    its configuration.
+
+    Files are saved in one subdirectory of `out_dir` per configuration (see
+    `config_name`). `kwargs` are passed to ``synthesize_many`` (e.g. `decay`
+    or `on_xrun`).
+
+    Returns
+    -------
+    list[dict] :
+        the summaries of ``synthesize_many``, each one with the key `config`
+        holding the configuration used
+    """
+    summary = []
+    for config, paths in group_jobs(jobs):
+        options = config_options(config, driver)
+        config_dir = os.path.join(out_dir, config_name(config))
+        print(f"Rendering {len(paths)} files at {config_name(config)}")
+        if processes is None:
+            check_free([server_name])
+            carla = Carla(proj_path,
+                          options,
+                          min_wait=min_wait,
+                          server_name=server_name,
+                          probe=probe)
+            carla.start()
+            try:
+                check_config(carla.client, config)
+                results = synthesize_many(carla, paths, config_dir,
+                                          **kwargs)
+            finally:
+                carla.kill()
+        else:
+            # the names used by `RenderPool`
+            check_free(f'pycarla{i}' for i in range(processes))
+            with RenderPool(proj_path,
+                            processes,
+                            server_options=options,
+                            min_wait=min_wait) as pool:
+                results = list(
+                    pool.synthesize_many(paths, config_dir, **kwargs))
+        for item in results:
+            item['config'] = config
+        summary += results
+    return summary
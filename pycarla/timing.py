@@ -0,0 +1,107 @@
+import numpy as np
+
+# microseconds per beat, as in the MIDI standard
+DEFAULT_TEMPO = 500000
+
+
+def merged_ticks(midifile):
+    """
+    Merges the tracks of a ``mido.MidiFile`` in the same order used by `mido`
+    when iterating over it.
+
+    Returns
+    -------
+    np.ndarray :
+        int64 array with the absolute tick of each message
+    list :
+        the messages, in the same order
+    """
+    if midifile.type == 2:
+        raise TypeError("can't merge tracks in type 2 (asynchronous) file")
+    ticks = []
+    messages = []
+    for track in midifile.tracks:
+        deltas = np.fromiter((m.time for m in track),
+                             dtype=np.int64,
+                             count=len(track))
+        ticks.append(np.cumsum(deltas))
+        messages.extend(track)
+    if len(messages) == 0:
+        return np.zeros(0, dtype=np.int64), messages
+    ticks = np.concatenate(ticks)
+    # stable, so that messages at the same tick keep the track order
+    order = np.argsort(ticks, kind='stable')
+    return ticks[order], [messages[i] for i in order]
+
+
+def tempo_map(ticks, messages):
+    """
+    Returns the ticks at which the tempo changes and the tempo (microseconds
+    per beat) starting at each of them; the first change is always at tick 0.
+    """
+    change_ticks = [0]
+    tempos = [DEFAULT_TEMPO]
+    for tick, msg in zip(ticks, messages):
+        if msg.type == 'set_tempo':
+            if tick == change_ticks[-1]:
+                tempos[-1] = msg.tempo
+            else:
+                change_ticks.append(tick)
+                tempos.append(msg.tempo)
+    return np.array(change_ticks, dtype=np.int64), np.array(tempos,
+                                                            dtype=np.float64)
+
+
+def ticks_to_seconds(ticks, change_ticks, tempos, ticks_per_beat):
+    """
+    Converts an array of absolute ticks to seconds in one vectorized pass,
+    following the tempo map returned by `tempo_map`
+    """
+    seconds_per_tick = tempos / (1e6 * ticks_per_beat)
+    # time at which each tempo change happens
+    change_seconds = np.zeros(len(change_ticks), dtype=np.float64)
+    np.cumsum(np.diff(change_ticks) * seconds_per_tick[:-1],
+              out=change_seconds[1:])
+    k = np.searchsorted(change_ticks, ticks, side='right') - 1
+    return change_seconds[k] + (ticks - change_ticks[k]) * seconds_per_tick[k]
+
+
+def midifile_times(midifile):
+    """
+    Returns the absolute time in seconds (float64) of each message of a
+    ``mido.MidiFile`` and the list of messages, merged as `mido` does.
+    """
+    ticks, messages = merged_ticks(midifile)
+    change_ticks, tempos = tempo_map(ticks, messages)
+    return ticks_to_seconds(ticks, change_ticks, tempos,
+                            midifile.ticks_per_beat), messages
+
+
+def track_times(midifile):
+    """
+    Returns, for each track of a ``mido.MidiFile``, the absolute time in
+    seconds (float64) of each of its messages and the list of its messages.
+    Times follow the tempo map of the whole file, as if tracks were merged.
+    """
+    if midifile.type == 2:
+        raise TypeError("can't merge tracks in type 2 (asynchronous) file")
+    ticks, messages = merged_ticks(midifile)
+    change_ticks, tempos = tempo_map(ticks, messages)
+    out = []
+    for track in midifile.tracks:
+        deltas = np.fromiter((m.time for m in track),
+                             dtype=np.int64,
+                             count=len(track))
+        out.append((ticks_to_seconds(np.cumsum(deltas), change_ticks, tempos,
+                                     midifile.ticks_per_beat), list(track)))
+    return out
+
+
+def midifile_frames(midifile, samplerate):
+    """
+    Returns the absolute frame (int64) of each message of a ``mido.MidiFile``
+    at `samplerate` and the list of messages. Times are accumulated in
+    float64 and rounded only once, so there is no drift on long files.
+    """
+    times, messages = midifile_times(midifile)
+    return np.round(times * samplerate).astype(np.int64), messages
@@ -3,14 +3,18 @@ import sys
 import os
 
 import psutil
-import mido
 
+from .cache import get_schedule
 
-def get_smf_duration(filename):
+
+def get_smf_duration(filename, cache=True):
     """
     Return note dration of a file from a path
+
+    The file is parsed only if it is not already in `cache` (see
+    `pycarla.cache.get_schedule`)
     """
-    return mido.MidiFile(filename).length
+    return get_schedule(filename, cache).duration
 
 
 def progressbar(count, block_size, total, status='Download'):
@@ -0,0 +1,24 @@
+import os
+import shutil
+
+import pytest
+
+SAMPLERATE = 48000
+PERIOD = 256
+
+
+@pytest.fixture
+def dummy_server():
+    """
+    A Jack server with the dummy driver running `benchmarks.fakecarla` in
+    place of Carla; yields the server name. Skipped if `jackd` is not
+    installed.
+    """
+    pytest.importorskip('jack')
+    if shutil.which('jackd') is None:
+        pytest.skip("jackd not found")
+    from benchmarks import fakecarla
+
+    name = f"pycarla-test-{os.getpid()}"
+    with fakecarla.dummy_server(name, SAMPLERATE, PERIOD):
+        yield name
@@ -0,0 +1,25 @@
+import os
+
+import pytest
+
+pytest.importorskip('jack')
+
+from pycarla.batch import output_jobs, output_path
+
+
+def test_output_path():
+    assert output_path(os.path.join('a', 'x.mid'), 'out', '.flac') ==\
+        os.path.join('out', 'x.flac')
+
+
+def test_output_jobs():
+    jobs = output_jobs(['a/x.mid', 'a/y.mid'], 'out', '.wav')
+    assert jobs == [('a/x.mid', os.path.join('out', 'x.wav')),
+                    ('a/y.mid', os.path.join('out', 'y.wav'))]
+
+
+def test_same_names_are_refused():
+    with pytest.raises(ValueError, match='x.wav'):
+        output_jobs(['a/x.mid', 'b/x.mid'], 'out', '.wav')
+    with pytest.raises(ValueError):
+        output_jobs(['a/x.mid', 'b/x.midi'], 'out', '.wav')
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from pycarla.buffers import ArrayBuffer, EventRing, RingBuffer
+
+
+def blocks(channels, frames, start=0):
+    """
+    One block per channel, where each sample encodes its channel and frame
+    """
+    t = np.arange(start, start + frames, dtype=np.float32)
+    return [t + 1e5 * c for c in range(channels)]
+
+
+def expected(channels, frames):
+    return np.stack(blocks(channels, frames))
+
+
+@pytest.mark.parametrize('layout', ['channels', 'frames'])
+def test_array_buffer_grows(layout):
+    buffer = ArrayBuffer(2, chunk_frames=100, layout=layout)
+    written = 0
+    for frames in [64, 64, 64, 128]:
+        buffer.write(blocks(2, frames, written), frames)
+        written += frames
+    assert buffer.capacity == 400
+    array = buffer.array if layout == 'channels' else buffer.array.T
+    np.testing.assert_array_equal(array, expected(2, written))
+
+
+@pytest.mark.parametrize('layout', ['channels', 'frames'])
+def test_array_buffer_compact(layout):
+    buffer = ArrayBuffer(3, frames=1000, layout=layout)
+    buffer.write(blocks(3, 600), 600)
+    data = buffer.data
+    compact = buffer.compact(100, 500)
+    assert compact.flags['C_CONTIGUOUS']
+    # no new array is allocated
+    assert np.shares_memory(compact, data)
+    array = compact if layout == 'channels' else compact.T
+    np.testing.assert_array_equal(array, expected(3, 500)[:, 100:])
+
+
+def test_array_buffer_last_above():
+    buffer = ArrayBuffer(2, frames=1000)
+    silence = [np.zeros(1000, dtype=np.float32)] * 2
+    buffer.write(silence, 1000)
+    buffer.data[1, 700] = 0.5
+    assert buffer.last_above(0.1, chunk=64) == 701
+    buffer.data[1, 700] = 0
+    assert buffer.last_above(0.1) == 0
+
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(2, 100)
+    read = []
+    written = 0
+    for frames in [60, 30, 50, 70]:
+        assert ring.write(blocks(2, frames, written), frames)
+        written += frames
+        segments = ring.peek()
+        # copied, since views are overwritten after `advance`
+        read += [np.array(s) for s in segments]
+        ring.advance(sum(s.shape[1] for s in segments))
+    np.testing.assert_array_equal(np.concatenate(read, axis=1),
+                                  expected(2, written))
+    assert ring.overflows == 0
+
+
+def test_ring_buffer_overflows():
+    ring = RingBuffer(1, 100)
+    assert ring.write(blocks(1, 80), 80)
+    assert not ring.write(blocks(1, 40), 40)
+    assert ring.overflows == 1
+    assert ring.available == 80 and ring.free == 20
+
+
+def test_closed_ring_buffer_never_waits():
+    ring = RingBuffer(1, 100)
+    assert ring.write(blocks(1, 80), 80)
+    ring.close()
+    assert not ring.write(blocks(1, 40), 40, wait=True)
+
+
+def test_ring_buffer_wait_is_checked_again():
+    ring = RingBuffer(1, 100)
+    assert ring.write(blocks(1, 80), 80)
+    calls = []
+
+    def wait():
+        # e.g. Jack leaving freewheeling mode while waiting
+        calls.append(None)
+        return len(calls) < 3
+
+    assert not ring.write(blocks(1, 40), 40, wait=wait)
+    assert len(calls) == 3 and ring.overflows == 1
+
+
+def test_event_ring():
+    ring = EventRing(capacity=2, max_bytes=3)
+    assert ring.push(b'\x90\x3c\x64', 10, 1)
+    assert ring.push(b'\x80\x3c', 20, 2)
+    assert not ring.push(b'\xf8', 30, 3)
+    assert ring.overflows == 1 and ring.available == 2
+    assert bytes(ring.rows[1][:ring.sizes[1]]) == b'\x80\x3c'
+    assert list(ring.frames) == [10, 20]
+    with pytest.raises(ValueError):
+        ring.push(b'\xf0\x00\x00\xf7', 40, 4)
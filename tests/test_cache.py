@@ -0,0 +1,102 @@
+import os
+
+import mido
+import numpy as np
+
+from pycarla.cache import ScheduleCache, get_schedule
+
+
+def write_midi(path, notes):
+    midifile = mido.MidiFile()
+    track = mido.MidiTrack()
+    for note in notes:
+        track.append(mido.Message('note_on', note=note, time=120))
+        track.append(mido.Message('note_off', note=note, time=240))
+    midifile.tracks.append(track)
+    midifile.save(str(path))
+    return path
+
+
+def assert_same(a, b):
+    np.testing.assert_array_equal(a.times, b.times)
+    np.testing.assert_array_equal(a.offsets, b.offsets)
+    assert a.data == b.data
+    assert a.duration == b.duration
+
+
+def test_cached_schedule_is_the_compiled_one(tmp_path):
+    cache = ScheduleCache(tmp_path / 'cache')
+    path = write_midi(tmp_path / 'a.mid', range(60, 72))
+    compiled = get_schedule(path, cache=False)
+    assert_same(cache.get(path), compiled)
+    assert len(os.listdir(cache.directory)) == 1
+    assert_same(cache.get(path), compiled)
+
+
+def test_corrupted_entries_are_compiled_again(tmp_path):
+    cache = ScheduleCache(tmp_path / 'cache')
+    path = write_midi(tmp_path / 'a.mid', [60, 62])
+    cache.get(path)
+    with open(cache._path(cache.key(path)), 'wb') as f:
+        f.write(b'not a npz')
+    assert_same(cache.get(path), get_schedule(path, cache=False))
+
+
+def test_least_recently_used_are_evicted(tmp_path):
+    cache = ScheduleCache(tmp_path / 'cache')
+    paths = [
+        write_midi(tmp_path / f'{i}.mid', range(40 + i, 80 + i))
+        for i in range(3)
+    ]
+    for i, path in enumerate(paths):
+        cache.get(path)
+        cached = cache._path(cache.key(path))
+        os.utime(cached, (i, i))
+    size = os.path.getsize(cached)
+    cache.max_bytes = 2 * size
+    cache.evict()
+    left = sorted(os.listdir(cache.directory))
+    assert left == sorted(
+        os.path.basename(cache._path(cache.key(p))) for p in paths[1:])
+    cache.clear()
+    assert os.listdir(cache.directory) == []
+
+
+def test_entry_evicted_by_another_process(tmp_path, monkeypatch):
+    cache = ScheduleCache(tmp_path / 'cache')
+    path = write_midi(tmp_path / 'a.mid', [60])
+    cache.get(path)
+    cached = cache._path(cache.key(path))
+    load = np.load
+
+    def load_then_evict(*args, **kwargs):
+        npz = load(*args, **kwargs)
+        os.remove(cached)
+        return npz
+
+    monkeypatch.setattr(np, 'load', load_then_evict)
+    assert_same(cache.get(path), get_schedule(path, cache=False))
+
+
+def test_directory_is_scanned_only_when_full(tmp_path, monkeypatch):
+    cache = ScheduleCache(tmp_path / 'cache')
+    paths = [
+        write_midi(tmp_path / f'{i}.mid', range(40 + i, 80 + i))
+        for i in range(4)
+    ]
+    cache.get(paths[0])
+    size = os.path.getsize(cache._path(cache.key(paths[0])))
+    cache.max_bytes = 2 * size
+    scans = []
+    scandir = os.scandir
+
+    def counted_scandir(*args, **kwargs):
+        scans.append(None)
+        return scandir(*args, **kwargs)
+
+    monkeypatch.setattr(os, 'scandir', counted_scandir)
+    cache.get(paths[1])
+    assert scans == []
+    cache.get(paths[2])
+    assert len(scans) == 1
+    assert len(os.listdir(cache.directory)) == 2
@@ -0,0 +1,51 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('jack')
+
+from pycarla import Carla
+from pycarla.generics import AsyncEvent
+
+
+def test_async_exit_kills_outside_of_the_loop(monkeypatch):
+    # not started, so neither Jack nor Carla are needed
+    carla = Carla.__new__(Carla)
+    threads = []
+    monkeypatch.setattr(carla, 'kill',
+                        lambda: threads.append(threading.current_thread()))
+    asyncio.run(carla.__aexit__(None, None, None))
+    assert len(threads) == 1 and threads[0] is not threading.main_thread()
+
+
+def test_wait_exists_times_out(monkeypatch):
+    carla = Carla.__new__(Carla)
+    carla._ready = AsyncEvent()
+    monkeypatch.setattr(carla, 'exists', lambda: False)
+    with pytest.raises(RuntimeError):
+        carla.wait_exists(timeout=0.1)
+
+
+def test_wait_exists_wakes_up_on_ready(monkeypatch):
+    carla = Carla.__new__(Carla)
+    carla._ready = AsyncEvent()
+    monkeypatch.setattr(carla, 'exists', carla._ready.is_set)
+    threading.Timer(0.05, carla._ready.set).start()
+    carla.wait_exists(timeout=5)
+
+
+def test_watchdog_reports_both_latencies(monkeypatch):
+    carla = Carla.__new__(Carla)
+    carla._died = threading.Event()
+    carla._stopping = False
+    carla.restarts = 0
+    carla.detection_latencies = []
+    carla.restart_latencies = []
+    monkeypatch.setattr(carla, 'restart_carla', lambda: time.sleep(0.05))
+    carla._Carla__signal_death(carla._died)
+    carla._Carla__watchdog(carla._died)
+    assert carla.restarts == 1
+    assert carla.detection_latencies[0] < 0.05
+    assert carla.restart_latencies[0] >= 0.05
@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip('jack')
+
+from pycarla.jackserver import server_name
+
+
+@pytest.mark.parametrize('cmdline, name', [
+    (None, None),
+    (['jackd', '-d', 'dummy'], None),
+    (['jackd', '-n', 'pycarla0', '-d', 'dummy'], 'pycarla0'),
+    (['jackd', '--name', 'pycarla1', '-d', 'dummy'], 'pycarla1'),
+    (['jackd', '-n', 'default', '-d', 'dummy'], None),
+    (['jackd', '-R', '-d', 'alsa', '-n', '3'], None),
+])
+def test_server_name(cmdline, name):
+    assert server_name(cmdline) == name
@@ -0,0 +1,92 @@
+import json
+
+from pycarla.journal import Journal, attempts, journaled
+
+
+def writer(content=b'audio', fail=0):
+    """
+    A fake render writing `content` to the output; the first `fail` calls
+    raise an exception
+    """
+    calls = []
+
+    def render(midi, audio):
+        calls.append(midi)
+        if len(calls) <= fail:
+            raise RuntimeError("Carla crashed")
+        with open(audio, 'wb') as f:
+            f.write(content)
+        return {'midi': midi, 'audio': audio, 'success': True}
+
+    render.calls = calls
+    return render
+
+
+def test_resume_skips_done_renders(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    jobs = [('a.mid', tmp_path / 'a.wav'), ('b.mid', tmp_path / 'b.wav')]
+    render = writer()
+    summary = journaled(render, jobs[:1], Journal(path))
+    assert [item['success'] for item in summary] == [True]
+
+    # a line truncated by a crash is ignored
+    with open(path, 'a') as f:
+        f.write('{"midi": "b.mid", "audio"')
+    summary = journaled(render, jobs, Journal(path))
+    assert [item['midi'] for item in summary] == ['b.mid']
+    assert render.calls == ['a.mid', 'b.mid']
+
+
+def test_retries_with_backoff(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    render = writer(fail=2)
+    summary = journaled(render, [('a.mid', tmp_path / 'a.wav')],
+                        Journal(path),
+                        retries=2,
+                        backoff=0)
+    assert summary[0]['success'] and summary[0]['retries'] == 2
+    statuses = [json.loads(line)['status'] for line in open(path)]
+    assert statuses == ['retry', 'retry', 'done']
+
+
+def test_missing_output_is_failed(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+
+    def render(midi, audio):
+        # as `render_file` when the output can't be saved
+        return {'midi': midi, 'audio': audio, 'success': True}
+
+    summary = journaled(render, [('a.mid', tmp_path / 'a.wav')],
+                        Journal(path),
+                        retries=1,
+                        backoff=0)
+    assert not summary[0]['success']
+    statuses = [json.loads(line)['status'] for line in open(path)]
+    assert statuses == ['retry', 'failed']
+    assert not Journal(path).is_done(tmp_path / 'a.wav')
+
+
+def test_unreadable_output_is_failed(tmp_path):
+    journal = Journal(tmp_path / 'journal.jsonl')
+    item = {'midi': 'a.mid', 'audio': tmp_path / 'a.wav', 'success': True}
+    record = journal.append(item, 'done')
+    assert record['status'] == 'failed' and not record['success']
+    assert not journal.is_done(tmp_path / 'a.wav')
+
+
+def test_verify_checksum(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    audio = tmp_path / 'a.wav'
+    journaled(writer(), [('a.mid', audio)], Journal(path))
+    assert Journal(path, verify=True).is_done(audio)
+    audio.write_bytes(b'corrupted')
+    assert Journal(path).is_done(audio)
+    assert not Journal(path, verify=True).is_done(audio)
+
+
+def test_attempts_report_exceptions(tmp_path):
+    results = list(
+        attempts(writer(fail=5), 'a.mid', tmp_path / 'a.wav', retries=1,
+                 backoff=0))
+    assert [status for item, status in results] == ['retry', 'failed']
+    assert 'Carla crashed' in results[-1][0]['error']
@@ -0,0 +1,21 @@
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip('jack')
+
+from pycarla.pool import RenderPool
+
+
+def job(session, x):
+    return x
+
+
+def test_workers_that_cant_start_break_the_pool(tmp_path):
+    # jackd can't start with an unknown driver (or isn't installed at all)
+    with RenderPool(str(tmp_path / 'missing.carxp'),
+                    processes=2,
+                    server_options=['-d', 'no-such-driver'],
+                    prefix='pycarla-broken') as pool:
+        with pytest.raises(BrokenProcessPool):
+            list(pool.imap(job, range(4)))
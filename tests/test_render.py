@@ -0,0 +1,78 @@
+import mido
+import numpy as np
+import pytest
+
+pytest.importorskip('jack')
+
+from benchmarks.run import onsets, synthetic_messages
+from pycarla import AudioRecorder, MIDIPlayer
+from pycarla.schedule import EventSchedule
+
+
+def render(player, recorder, schedule, **kwargs):
+    recorder.start(schedule.duration + 0.5,
+                   condition=player.is_ready,
+                   **kwargs)
+    # a player that ended its previous job must not look ready
+    assert not player.is_ready()
+    player.synthesize_messages(schedule, condition=recorder.is_ready)
+    assert player.wait(in_fw=True, out_fw=True)
+    assert recorder.wait(in_fw=True, out_fw=True)
+    assert player.started_at == recorder.started_at
+    return recorder.recorded
+
+
+def test_onsets_are_sample_accurate(dummy_server):
+    schedule = EventSchedule.from_messages(synthetic_messages(5))
+    with MIDIPlayer(dummy_server) as player,\
+            AudioRecorder(dummy_server) as recorder:
+        recorded = render(player, recorder, schedule)
+        recorder.set_freewheel(False)
+    # the fake Carla starts a cosine exactly at the frame of each note-on
+    expected = schedule.frames(recorder.client.samplerate)[::2]
+    np.testing.assert_array_equal(onsets(recorded), expected)
+
+
+def test_persistent_jobs_back_to_back(dummy_server):
+    schedule = EventSchedule.from_messages(synthetic_messages(2))
+    with MIDIPlayer(dummy_server, persistent=True) as player,\
+            AudioRecorder(dummy_server, persistent=True) as recorder:
+        expected = schedule.frames(recorder.client.samplerate)[::2]
+        recorder.set_freewheel(True)
+        for job in range(3):
+            recorded = render(player,
+                              recorder,
+                              schedule,
+                              silence_threshold=1e-4,
+                              after=lambda: player.end_wait.is_set())
+            # the recording can't end on the silence before of the first note
+            assert recorded.shape[1] >= expected[-1]
+            np.testing.assert_array_equal(onsets(recorded), expected)
+        recorder.set_freewheel(False)
+
+
+def test_clients_close_without_jobs(dummy_server):
+    # e.g. a `RenderSession` closed before of its first job
+    MIDIPlayer(dummy_server, persistent=True).close()
+    AudioRecorder(dummy_server, persistent=True).close()
+
+
+def test_stream_then_close(dummy_server):
+    player = MIDIPlayer(dummy_server)
+    player.stream()
+    assert player.push(mido.Message('note_on', note=60))
+    player.end_stream()
+    assert player.wait(timeout=5)
+    player.close()
+
+
+def test_track_routes_then_close(dummy_server):
+    midifile = mido.MidiFile()
+    track = mido.MidiTrack([mido.MetaMessage('track_name', name='piano')])
+    track.append(mido.Message('note_on', note=60, time=0))
+    track.append(mido.Message('note_off', note=60, time=120))
+    midifile.tracks.append(track)
+    player = MIDIPlayer(dummy_server, port_map={'piano': MIDIPlayer.MIDI_PORT})
+    player.synthesize_midi_file(midifile, sync=True, timeout=5)
+    assert len(player._messages) == 1
+    player.close()
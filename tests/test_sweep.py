@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('jack')
+
+from pycarla.sweep import (check_config, config_name, config_options,
+                           group_jobs, product)
+
+LOW = {'samplerate': 44100, 'period': 256}
+HIGH = {'samplerate': 96000, 'period': 64, 'options': ['-n', '3']}
+
+
+def test_config_options():
+    assert config_options(LOW) == ['-d', 'dummy', '-r', '44100', '-p', '256']
+    assert config_options(HIGH, 'alsa') == [
+        '-d', 'alsa', '-r', '96000', '-p', '64', '-n', '3'
+    ]
+    assert config_name(HIGH) == '96000Hz-64'
+
+
+def test_group_jobs_keeps_first_appearance_order():
+    jobs = product(['a.mid', 'b.mid'], [HIGH, LOW])
+    assert len(jobs) == 4
+    # jobs interleaving configurations are grouped
+    groups = group_jobs(jobs[::-1])
+    assert [config for config, paths in groups] == [LOW, HIGH]
+    assert [paths for config, paths in groups] == [['b.mid', 'a.mid']] * 2
+
+
+def test_options_are_part_of_the_configuration():
+    other = dict(HIGH, options=['-n', '2'])
+    groups = group_jobs([('a.mid', HIGH), ('a.mid', other)])
+    assert len(groups) == 2
+
+
+def test_check_config():
+    check_config(SimpleNamespace(samplerate=44100, blocksize=256), LOW)
+    with pytest.raises(RuntimeError, match='44100Hz-256'):
+        check_config(SimpleNamespace(samplerate=48000, blocksize=256), LOW)
+    with pytest.raises(RuntimeError):
+        check_config(SimpleNamespace(samplerate=44100, blocksize=1024), LOW)
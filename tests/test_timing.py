@@ -0,0 +1,124 @@
+import mido
+import numpy as np
+import pytest
+
+from pycarla.schedule import EventSchedule
+from pycarla.timing import midifile_frames, midifile_times, track_times
+
+
+def tempo_map_file(seed=0, notes=500):
+    """
+    A type 1 file with a conductor track full of tempo changes and two
+    tracks of notes with random delta times
+    """
+    rng = np.random.default_rng(seed)
+    midifile = mido.MidiFile(type=1, ticks_per_beat=480)
+    conductor = mido.MidiTrack()
+    for delta in rng.integers(0, 2000, size=50):
+        conductor.append(
+            mido.MetaMessage('set_tempo',
+                             tempo=int(rng.integers(200000, 1500000)),
+                             time=int(delta)))
+    conductor.append(mido.MetaMessage('end_of_track'))
+    midifile.tracks.append(conductor)
+    for channel in range(2):
+        track = mido.MidiTrack()
+        track.append(mido.MetaMessage('track_name', name=f'part{channel}'))
+        for delta in rng.integers(0, 300, size=notes):
+            note = int(rng.integers(21, 109))
+            track.append(
+                mido.Message('note_on',
+                             channel=channel,
+                             note=note,
+                             velocity=90,
+                             time=int(delta)))
+            track.append(
+                mido.Message('note_off',
+                             channel=channel,
+                             note=note,
+                             time=int(rng.integers(1, 200))))
+        track.append(mido.MetaMessage('end_of_track'))
+        midifile.tracks.append(track)
+    return midifile
+
+
+def mido_times(midifile):
+    """
+    Absolute times and messages obtained by iterating over `midifile` with
+    `mido`
+    """
+    messages = list(midifile)
+    return np.cumsum([m.time for m in messages]), messages
+
+
+def without_end_of_track(times, messages):
+    """
+    `mido` keeps only the last ``end_of_track``, while `pycarla.timing`
+    keeps one per track
+    """
+    keep = [i for i, m in enumerate(messages) if m.type != 'end_of_track']
+    return times[keep], [messages[i] for i in keep]
+
+
+def test_midifile_times_match_mido():
+    midifile = tempo_map_file()
+    expected, expected_messages = mido_times(midifile)
+    times, messages = midifile_times(midifile)
+    assert times[-1] == pytest.approx(expected[-1], abs=1e-9)
+    expected, expected_messages = without_end_of_track(
+        expected, expected_messages)
+    times, messages = without_end_of_track(times, messages)
+    assert len(messages) == len(expected_messages)
+    for m, e in zip(messages, expected_messages):
+        assert m.copy(time=0) == e.copy(time=0)
+    np.testing.assert_allclose(times, expected, rtol=0, atol=1e-9)
+
+
+def test_schedule_matches_mido():
+    midifile = tempo_map_file(seed=1)
+    expected, messages = mido_times(midifile)
+    keep = [i for i, m in enumerate(messages) if not m.is_meta]
+    schedule = EventSchedule.from_midifile(midifile)
+    assert len(schedule) == len(keep)
+    np.testing.assert_allclose(schedule.times,
+                               expected[keep],
+                               rtol=0,
+                               atol=1e-9)
+    for i, k in enumerate(keep):
+        assert schedule.event(i).tobytes() == bytes(messages[k].bytes())
+    assert schedule.duration == pytest.approx(expected[-1], abs=1e-9)
+
+    # the path for already parsed messages gives the same times
+    from_messages = EventSchedule.from_messages(messages)
+    np.testing.assert_allclose(from_messages.times,
+                               schedule.times,
+                               rtol=0,
+                               atol=1e-9)
+
+
+def test_frames_are_rounded_once():
+    midifile = tempo_map_file(seed=2)
+    expected, _ = without_end_of_track(*mido_times(midifile))
+    frames, _ = without_end_of_track(*midifile_frames(midifile, 48000))
+    np.testing.assert_array_equal(frames,
+                                  np.round(expected * 48000).astype(np.int64))
+
+
+def test_track_times_follow_merged_tempo_map():
+    midifile = tempo_map_file(seed=3)
+    expected, messages = mido_times(midifile)
+    tracks = track_times(midifile)
+    assert [len(m) for t, m in tracks] == [len(t) for t in midifile.tracks]
+    # each track of notes uses its own channel
+    for channel, (times, track_messages) in enumerate(tracks[1:]):
+        notes = [
+            i for i, m in enumerate(track_messages) if m.type == 'note_on'
+        ]
+        merged = [
+            i for i, m in enumerate(messages)
+            if m.type == 'note_on' and m.channel == channel
+        ]
+        np.testing.assert_allclose(times[notes],
+                                   expected[merged],
+                                   rtol=0,
+                                   atol=1e-9)